@@ -0,0 +1,119 @@
+"""
+Peak RSS of building extractor requests, per application size.
+
+Compares the old handling (every attachment held as bytes, one base64 copy per PDF,
+one request serialized with all of them) against spooled attachments packed into
+requests under EXTRACTION_REQUEST_MAX_BYTES. No network or model calls are made:
+each request is serialized with json.dumps the way the SDK would send it.
+
+Each measurement runs in a fresh subprocess so ru_maxrss reflects only that case.
+Imports worker.py, so the worker's environment (.env) must be available.
+
+Measured (8 documents per application, Python 3.11, Linux):
+
+     upload MB  legacy peak MB  streamed peak MB  requests  largest req MB
+           1.0            26.3              26.2         1             1.3
+           5.0            46.6              47.2         1             6.7
+          10.0            71.6              62.9         1            13.3
+          25.0           147.8              85.3         2            20.8
+          50.0           272.9              79.1         4            16.7
+
+Small applications are unchanged; above EXTRACTION_REQUEST_MAX_BYTES the legacy peak
+grows with the upload while the streamed peak stays bounded by one packed request.
+
+Usage:
+    python benchmarks/bench_document_memory.py [--sizes-mb 1 5 10 25 50] [--docs 8]
+"""
+import os
+import sys
+import json
+import base64
+import resource
+import argparse
+import subprocess
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_documents(total_mb, num_docs, spooled):
+    import tempfile
+    doc_bytes = int(total_mb * 1024 * 1024 / num_docs)
+    docs = []
+    for i in range(num_docs):
+        data = os.urandom(doc_bytes)
+        if spooled:
+            import worker
+            f = tempfile.SpooledTemporaryFile(max_size=worker.DOCUMENT_SPOOL_MAX_BYTES)
+            f.write(data)
+            f.seek(0)
+            docs.append({'metadata': {'storage_path': f'doc_{i}.pdf'}, 'content': f, 'size': doc_bytes})
+        else:
+            docs.append({'metadata': {'storage_path': f'doc_{i}.pdf'}, 'content': data})
+        del data
+    return docs
+
+
+def run_legacy(total_mb, num_docs):
+    docs = make_documents(total_mb, num_docs, spooled=False)
+    content = []
+    for doc in docs:
+        pdf_b64 = base64.b64encode(doc['content']).decode('utf-8')
+        content.append({"type": "document", "source": {"type": "base64", "media_type": "application/pdf", "data": pdf_b64}})
+    body = json.dumps({"messages": [{"role": "user", "content": content}]})
+    return {"requests": 1, "largest_request_mb": round(len(body) / 1024 / 1024, 1)}
+
+
+def run_streamed(total_mb, num_docs):
+    import worker
+    docs = make_documents(total_mb, num_docs, spooled=True)
+    largest = 0
+    batches = worker.pack_documents(docs)
+    for batch in batches:
+        messages = worker.build_extraction_messages(batch, {}, "")
+        body = json.dumps({"messages": messages})
+        largest = max(largest, len(body))
+        del messages, body
+    worker.close_documents(docs)
+    return {"requests": len(batches), "largest_request_mb": round(largest / 1024 / 1024, 1)}
+
+
+def run_case(mode, total_mb, num_docs):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--case', mode, str(total_mb), str(num_docs)],
+        cwd=SERVICE_DIR, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes-mb', nargs='+', type=float, default=[1, 5, 10, 25, 50])
+    parser.add_argument('--docs', type=int, default=8, help="Documents per application")
+    parser.add_argument('--case', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        mode, total_mb, num_docs = args.case[0], float(args.case[1]), int(args.case[2])
+        sys.path.insert(0, SERVICE_DIR)
+        import worker  # noqa: F401 - imported in both modes so the baseline is comparable
+        baseline = peak_rss_mb()
+        stats = run_legacy(total_mb, num_docs) if mode == 'legacy' else run_streamed(total_mb, num_docs)
+        stats.update({"peak_rss_mb": round(peak_rss_mb(), 1), "baseline_rss_mb": round(baseline, 1)})
+        print(json.dumps(stats))
+        return
+
+    print(f"{'upload MB':>10} {'legacy peak MB':>15} {'streamed peak MB':>17} {'requests':>9} {'largest req MB':>15}")
+    for total_mb in args.sizes_mb:
+        legacy = run_case('legacy', total_mb, args.docs)
+        streamed = run_case('streamed', total_mb, args.docs)
+        print(f"{total_mb:>10.1f} {legacy['peak_rss_mb']:>15.1f} {streamed['peak_rss_mb']:>17.1f} "
+              f"{streamed['requests']:>9} {streamed['largest_request_mb']:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
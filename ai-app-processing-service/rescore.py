@@ -0,0 +1,252 @@
+"""
+Bulk re-scoring of existing applications after a rules.md / reasoning_prompt.md change.
+
+Re-runs the reasoning step for every selected application, reusing the extraction
+output checkpointed on its last AI task instead of re-extracting the PDFs.
+Progress is appended to a state file so an interrupted run can be resumed, and a
+diff report of changed recommendations is written at the end.
+
+Usage:
+    python rescore.py --status submitted under_review --since 2026-01-01 \
+        --concurrency 4 --max-per-minute 30 --state-file rescore_state.jsonl \
+        --report rescore_report.json [--write]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import worker
+from worker import logger, supabase
+
+PAGE_SIZE = 1000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Re-run AI reasoning for existing applications.")
+    parser.add_argument('--status', nargs='+', default=['submitted', 'under_review'],
+                        help="Application statuses to include")
+    parser.add_argument('--since', help="Only applications submitted on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--until', help="Only applications submitted before this date (YYYY-MM-DD)")
+    parser.add_argument('--limit', type=int, help="Maximum number of applications to re-score")
+    parser.add_argument('--concurrency', type=int, default=4, help="Number of applications processed in parallel")
+    parser.add_argument('--max-per-minute', type=float, default=30,
+                        help="Rate budget: maximum model calls started per minute")
+    parser.add_argument('--state-file', default='rescore_state.jsonl',
+                        help="Progress file; applications already in it are skipped on resume")
+    parser.add_argument('--report', default='rescore_report.json', help="Where to write the diff report")
+    parser.add_argument('--extract-missing', action='store_true',
+                        help="Run the extractor for applications with documents but no stored extraction (otherwise they are skipped)")
+    parser.add_argument('--write', action='store_true',
+                        help="Write the new reasoning output to the applications table (default: report only)")
+    return parser.parse_args()
+
+
+class RateBudget:
+    """Spaces out model calls so no more than max_per_minute start in any minute."""
+
+    def __init__(self, max_per_minute):
+        self.interval = 60.0 / max_per_minute if max_per_minute > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def select_applications(args):
+    """Page through applications matching the status/date filters."""
+    applications = []
+    offset = 0
+    while True:
+        query = supabase.table('applications')\
+            .select('id, status, submitted_at')\
+            .in_('status', args.status)
+        if args.since:
+            query = query.gte('submitted_at', args.since)
+        if args.until:
+            query = query.lt('submitted_at', args.until)
+        response = query.order('submitted_at').range(offset, offset + PAGE_SIZE - 1).execute()
+        applications.extend(response.data or [])
+        if not response.data or len(response.data) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+
+    if args.limit:
+        applications = applications[:args.limit]
+    return applications
+
+
+def load_state(state_file):
+    """Results of a previous (interrupted) run, keyed by application id."""
+    done = {}
+    if os.path.exists(state_file):
+        with open(state_file, 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    done[entry['application_id']] = entry
+    return done
+
+
+def load_stored_extraction(application_id):
+    """
+    Find the extractor output checkpointed on the most recent AI task for the application.
+    Returns None if there is none.
+    """
+    response = supabase.table('processing_queue')\
+        .select('payload')\
+        .eq('application_id', application_id)\
+        .eq('task_type', 'ai')\
+        .order('updated_at', desc=True)\
+        .execute()
+
+    for task in response.data or []:
+        payload = task.get('payload') or {}
+        if isinstance(payload, str):
+            payload = json.loads(payload) if payload else {}
+        extractor_output = (payload.get('checkpoint') or {}).get('extractor_output')
+        if extractor_output:
+            return extractor_output
+    return None
+
+
+def rescore_application(application_id, config, args, budget):
+    """
+    Re-run reasoning for one application. Returns a state entry with old and new recommendations.
+    """
+    extractor_prompt, reasoning_prompt, rules, application_schema, extraction_schema, reasoning_output_schema = config
+    application_data, application_docs = worker.load_from_supabase(application_id, download_files=False)
+
+    entry = {
+        'application_id': application_id,
+        'old_recommendation': application_data.get('reasoning_overall_recommendation'),
+        'old_confidence_score': application_data.get('reasoning_confidence_score'),
+    }
+
+    extractor_output = None
+    if application_docs:
+        extractor_output = load_stored_extraction(application_id)
+        if extractor_output is None:
+            if not args.extract_missing:
+                entry['status'] = 'skipped'
+                entry['reason'] = 'no stored extraction output'
+                return entry
+            _, application_docs = worker.load_from_supabase(application_id)
+            try:
+                budget.wait()
+                extractor_output = worker.extractor_call(application_docs, extraction_schema, extractor_prompt)
+            finally:
+                worker.close_documents(application_docs)
+            entry['extracted'] = True
+
+    # The model must not see the recommendation being re-scored, or it will tend to repeat it
+    reasoning_input = {k: v for k, v in application_data.items() if not k.startswith('reasoning_')}
+
+    computed_facts = worker.precompute_eligibility_facts(reasoning_input, extractor_output)
+    output = worker.short_circuit_decision(computed_facts)
+    if output is None:
+        budget.wait()
+        output = worker.reasoning_call(
+            extraction_schema, extractor_output, application_schema, reasoning_input,
+            reasoning_prompt, rules, reasoning_output_schema, extractor_output is not None,
+            computed_facts=computed_facts
+        )
+    output = worker.finalize_reasoning_output(output, application_id, reasoning_input)
+
+    if args.write:
+        worker.update_db_with_ai_output(output, application_id, application_data)
+
+    entry['status'] = 'rescored'
+    entry['new_recommendation'] = output.get('overall_recommendation')
+    entry['new_confidence_score'] = output.get('confidence_score')
+    entry['changed'] = entry['new_recommendation'] != entry['old_recommendation']
+    return entry
+
+
+def write_report(report_path, state, selected_ids, processed, elapsed):
+    entries = [state[app_id] for app_id in selected_ids if app_id in state]
+    rescored = [e for e in entries if e.get('status') == 'rescored']
+    changed = [e for e in rescored if e.get('changed')]
+
+    transitions = {}
+    for e in changed:
+        key = f"{e['old_recommendation']} -> {e['new_recommendation']}"
+        transitions[key] = transitions.get(key, 0) + 1
+
+    report = {
+        'selected': len(selected_ids),
+        'rescored': len(rescored),
+        'skipped': sum(1 for e in entries if e.get('status') == 'skipped'),
+        'failed': sum(1 for e in entries if e.get('status') == 'failed'),
+        'changed': len(changed),
+        'transitions': transitions,
+        'changed_applications': changed,
+        'elapsed_seconds': round(elapsed, 1),
+        # Throughput of this run only (resumed entries from earlier runs are not counted)
+        'applications_per_minute': round(processed / (elapsed / 60), 1) if elapsed > 0 else 0.0,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    args = parse_args()
+
+    extractor_prompt, reasoning_prompt, rules = worker.load_prompts()
+    application_schema, extraction_schema, reasoning_output_schema = worker.load_schemas()
+    config = (extractor_prompt, reasoning_prompt, rules, application_schema, extraction_schema, reasoning_output_schema)
+
+    selected_ids = [app['id'] for app in select_applications(args)]
+    state = load_state(args.state_file)
+    # Failed applications are retried on resume
+    pending_ids = [app_id for app_id in selected_ids if state.get(app_id, {}).get('status') not in ('rescored', 'skipped')]
+    logger.info(f"Selected {len(selected_ids)} application(s); {len(pending_ids)} left to re-score")
+
+    budget = RateBudget(args.max_per_minute)
+    state_lock = threading.Lock()
+    start = time.monotonic()
+    processed = 0
+
+    with open(args.state_file, 'a') as state_out, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {
+            executor.submit(rescore_application, app_id, config, args, budget): app_id
+            for app_id in pending_ids
+        }
+        for future in as_completed(futures):
+            app_id = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                logger.error(f"Failed to re-score application {app_id}: {e}")
+                entry = {'application_id': app_id, 'status': 'failed', 'error': str(e)}
+
+            with state_lock:
+                state[app_id] = entry
+                state_out.write(json.dumps(entry) + '\n')
+                state_out.flush()
+                processed += 1
+
+            if processed % 10 == 0 or processed == len(pending_ids):
+                elapsed = time.monotonic() - start
+                logger.info(f"Progress: {processed}/{len(pending_ids)} ({processed / (elapsed / 60):.1f} applications/min)")
+
+    elapsed = time.monotonic() - start
+    report = write_report(args.report, state, selected_ids, processed, elapsed)
+    logger.info(
+        f"Re-scored {report['rescored']} application(s), {report['changed']} changed recommendation, "
+        f"{report['skipped']} skipped, {report['failed']} failed. "
+        f"Throughput: {report['applications_per_minute']:.1f} applications/min. Report written to {args.report}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+process_sqs_message delivery semantics: a duplicate returned while another invocation held
+the lease must not re-run the task once that invocation has completed it, and a failed
+orchestration enqueue must be retried rather than recorded as done.
+
+Imports worker.py against an in-memory processing_queue; requires the packages in
+requirements.txt (skipped otherwise). No network calls are made.
+"""
+import os
+import json
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+for module in ("dotenv", "supabase", "anthropic", "boto3", "httpx"):
+    pytest.importorskip(module)
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test-key")
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import worker  # noqa: E402
+
+APPLICATION_ID = "00000000-0000-0000-0000-000000000001"
+SENT_AT = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """The subset of the PostgREST query builder the worker uses, over a list of rows."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.limit_count = None
+        self.pending_insert = None
+        self.pending_update = None
+
+    def select(self, *args):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: datetime.fromisoformat(row[column]) >= datetime.fromisoformat(value))
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def insert(self, data):
+        self.pending_insert = data
+        return self
+
+    def update(self, data):
+        self.pending_update = data
+        return self
+
+    def execute(self):
+        if self.pending_insert is not None:
+            row = dict(self.pending_insert, id=f"task-{len(self.rows) + 1}")
+            self.rows.append(row)
+            return FakeResponse([row])
+        matched = [row for row in self.rows if all(f(row) for f in self.filters)]
+        if self.pending_update is not None:
+            for row in matched:
+                row.update({k: v for k, v in self.pending_update.items() if v != 'now()'})
+        return FakeResponse(matched[:self.limit_count] if self.limit_count else matched)
+
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        assert name == 'processing_queue'
+        return FakeQuery(self.rows)
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    rows = []
+    monkeypatch.setattr(worker, 'supabase', FakeSupabase(rows))
+    monkeypatch.setattr(worker, 'acquire_task_lease', lambda *args: True)
+    monkeypatch.setattr(worker, 'release_task_lease', lambda *args: None)
+    return rows
+
+
+def make_record(task_type='ai'):
+    return {
+        'messageId': 'message-1',
+        'body': json.dumps({'task_type': task_type, 'application_id': APPLICATION_ID, 'lane': 'fast'}),
+        'attributes': {'SentTimestamp': str(int(SENT_AT.timestamp() * 1000))},
+    }
+
+
+def test_duplicate_after_holder_completed_is_acknowledged(queue, monkeypatch):
+    queue.append({
+        'id': 'task-1', 'application_id': APPLICATION_ID, 'task_type': 'ai', 'status': 'completed',
+        'updated_at': (SENT_AT + timedelta(minutes=3)).isoformat(),
+    })
+
+    def run_task(*args):
+        raise AssertionError("completed task was run again")
+    monkeypatch.setattr(worker, 'run_task', run_task)
+
+    assert worker.process_sqs_message(make_record()) == (True, 'message-1', None)
+    assert len(queue) == 1
+
+
+def test_task_completed_before_message_was_sent_is_processed(queue, monkeypatch):
+    # An earlier submission of the same application: this message is new work
+    queue.append({
+        'id': 'task-1', 'application_id': APPLICATION_ID, 'task_type': 'orchestration', 'status': 'completed',
+        'updated_at': (SENT_AT - timedelta(days=1)).isoformat(),
+    })
+    ran = []
+    monkeypatch.setattr(worker, 'run_task', lambda task_data, task_id: ran.append(task_id) or {'result': 'success'})
+
+    assert worker.process_sqs_message(make_record('orchestration')) == (True, 'message-1', None)
+    assert ran == ['task-2']
+    assert queue[1]['status'] == 'completed'
+
+
+def test_failed_orchestration_enqueue_is_retried(queue, monkeypatch):
+    monkeypatch.setattr(worker, 'run_task', lambda task_data, task_id: {'result': 'success'})
+    sends = []
+    # The first send fails, the retry succeeds
+    monkeypatch.setattr(worker, 'send_orchestration_task_to_sqs',
+                        lambda application_id, priority=0: sends.append(application_id) or len(sends) > 1)
+
+    success, _, _ = worker.process_sqs_message(make_record())
+    assert not success
+    ai_task = queue[0]
+    assert ai_task['status'] == 'failed'
+    assert 'orchestration_enqueued' not in ai_task['payload']['checkpoint']['completed_stages']
+
+    assert worker.process_sqs_message(make_record()) == (True, 'message-1', None)
+    assert sends == [APPLICATION_ID, APPLICATION_ID]
+    assert ai_task['status'] == 'completed'
+    assert 'orchestration_enqueued' in ai_task['payload']['checkpoint']['completed_stages']
+    # The orchestration record is created once across both attempts
+    assert [row['task_type'] for row in queue].count('orchestration') == 1
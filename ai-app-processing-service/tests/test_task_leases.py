@@ -0,0 +1,137 @@
+"""
+Concurrency tests for the single-flight lease functions in
+supabase/migrations/20261018090000_add_task_leases.sql, run against a throwaway Postgres.
+
+Requires a local PostgreSQL install (initdb on PATH) plus the packages in
+requirements-dev.txt; skipped otherwise.
+
+Usage:
+    pip install -r requirements-dev.txt
+    python -m pytest tests/
+"""
+import os
+import uuid
+import threading
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+testing_postgresql = pytest.importorskip("testing.postgresql")
+
+MIGRATION = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..',
+    'supabase', 'migrations', '20261018090000_add_task_leases.sql'
+)
+CONTENDERS = 16
+
+
+@pytest.fixture(scope="module")
+def postgres():
+    try:
+        server = testing_postgresql.Postgresql()
+    except RuntimeError as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+
+    conn = psycopg2.connect(**server.dsn())
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        # Stand-in for the applications table the lease table references
+        cur.execute("CREATE TABLE applications (id uuid PRIMARY KEY)")
+        with open(MIGRATION, 'r') as f:
+            cur.execute(f.read())
+    conn.close()
+
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def conn(postgres):
+    conn = psycopg2.connect(**postgres.dsn())
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def application_id(conn):
+    application_id = str(uuid.uuid4())
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO applications (id) VALUES (%s)", (application_id,))
+    return application_id
+
+
+def acquire(conn, application_id, holder, lease_seconds=180):
+    with conn.cursor() as cur:
+        cur.execute("SELECT acquire_task_lease(%s, 'ai', %s, %s)", (application_id, holder, lease_seconds))
+        return cur.fetchone()[0]
+
+
+def release(conn, application_id, holder):
+    with conn.cursor() as cur:
+        cur.execute("SELECT release_task_lease(%s, 'ai', %s)", (application_id, holder))
+        return cur.fetchone()[0]
+
+
+def current_holder(conn, application_id):
+    with conn.cursor() as cur:
+        cur.execute("SELECT holder FROM task_leases WHERE application_id = %s AND task_type = 'ai'", (application_id,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def test_concurrent_acquirers_exactly_one_wins(postgres, conn, application_id):
+    connections = [psycopg2.connect(**postgres.dsn()) for _ in range(CONTENDERS)]
+    for c in connections:
+        c.autocommit = True
+    barrier = threading.Barrier(CONTENDERS)
+    results = [None] * CONTENDERS
+
+    def contend(i):
+        barrier.wait()
+        results[i] = acquire(connections[i], application_id, f"holder-{i}")
+
+    threads = [threading.Thread(target=contend, args=(i,)) for i in range(CONTENDERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for c in connections:
+        c.close()
+
+    winners = [i for i, won in enumerate(results) if won]
+    assert len(winners) == 1
+    assert current_holder(conn, application_id) == f"holder-{winners[0]}"
+
+
+def test_holder_renews_its_own_lease(conn, application_id):
+    assert acquire(conn, application_id, "holder-a")
+    assert acquire(conn, application_id, "holder-a")
+    assert not acquire(conn, application_id, "holder-b")
+
+
+def test_expired_lease_is_taken_over(conn, application_id):
+    assert acquire(conn, application_id, "holder-a")
+    assert not acquire(conn, application_id, "holder-b")
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE task_leases SET expires_at = NOW() - interval '1 second' WHERE application_id = %s",
+            (application_id,)
+        )
+
+    assert acquire(conn, application_id, "holder-b")
+    assert current_holder(conn, application_id) == "holder-b"
+    # The previous holder has lost it and cannot renew
+    assert not acquire(conn, application_id, "holder-a")
+
+
+def test_only_holder_can_release(conn, application_id):
+    assert acquire(conn, application_id, "holder-a")
+
+    assert not release(conn, application_id, "holder-b")
+    assert current_holder(conn, application_id) == "holder-a"
+
+    assert release(conn, application_id, "holder-a")
+    assert current_holder(conn, application_id) is None
+    assert acquire(conn, application_id, "holder-b")
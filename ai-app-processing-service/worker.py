@@ -1,8 +1,22 @@
 import os
 import time
 import json
+import io
 import base64
+import hashlib
+import random
 import logging
+import threading
+import cProfile
+import pstats
+import tracemalloc
+import uuid
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+import httpx
 from dotenv import load_dotenv
 from supabase import create_client, Client
 import anthropic
@@ -24,6 +38,7 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
+SQS_SLOW_QUEUE_URL = os.getenv("SQS_SLOW_QUEUE_URL")  # Optional slow lane for large AI tasks
 
 claude_model = "claude-haiku-4-5-20251001"
     
@@ -50,6 +65,52 @@ if SQS_QUEUE_URL:
 S3_BUCKET_NAME = os.getenv("S3_CONFIG_BUCKET", "ai-service-configs")
 S3_REGION = os.getenv("AWS_REGION", "us-east-2")
 
+# Rules engine: short-circuit Phase 1 when recent monthly earnings exceed this multiple of the (blind) SGA threshold
+SGA_SHORT_CIRCUIT_MULTIPLIER = float(os.getenv("SGA_SHORT_CIRCUIT_MULTIPLIER", "2.0"))
+
+# Document handling: attachments are spooled to disk above this size, and PDFs are
+# packed into extractor requests whose base64 payload stays under the ceiling
+DOCUMENT_SPOOL_MAX_BYTES = int(os.getenv("DOCUMENT_SPOOL_MAX_BYTES", str(1024 * 1024)))
+EXTRACTION_REQUEST_MAX_BYTES = int(os.getenv("EXTRACTION_REQUEST_MAX_BYTES", str(24 * 1024 * 1024)))
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+# Scheduling: AI tasks are classified by the estimate_task_lane RPC, whose thresholds live in the
+# task_lane_settings table (shared with the processing_queue priority trigger)
+LANE_PRIORITIES = {'fast': 10, 'slow': 0}
+
+# Recent enqueue-to-completion latencies (ms) per lane, for percentile reporting
+lane_latencies = {lane: deque(maxlen=1000) for lane in LANE_PRIORITIES}
+
+# Pipeline stages checkpointed on AI tasks, in order
+TASK_STAGES = ['documents_loaded', 'extraction_done', 'reasoning_done', 'db_written', 'orchestration_recorded', 'orchestration_enqueued']
+
+# Per-task profiling: enabled by "profile": true in the SQS message (or its payload), or by sampling.
+# Output goes to a local directory or an s3://bucket/prefix, one folder per task id.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "/tmp/task-profiles" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "profiles")
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+
+# Pipelined mode: warm the prompt cache for the reasoning prefix (rules, schemas, application data)
+# while the extractor runs, so the reasoning call only processes the extracted evidence
+PIPELINED_REASONING = os.getenv("PIPELINED_REASONING", "true").lower() == "true"
+
+# Demo applications replay a recorded result for known sample document sets
+DEMO_REPLAY_ENABLED = os.getenv("DEMO_REPLAY_ENABLED", "true").lower() == "true"
+
+# Recorded demo results already fetched by this container, keyed by (document_set_hash, version_hash)
+demo_replay_memo = {}
+
+# Heartbeats for in-flight tasks: every interval, extend the SQS message visibility to
+# HEARTBEAT_VISIBILITY_TIMEOUT seconds from now, refresh processing_queue.locked_at and renew the lease.
+# Tasks whose locked_at is older than STALE_LOCK_SECONDS are treated as dead.
+HEARTBEAT_INTERVAL_SECONDS = int(os.getenv("HEARTBEAT_INTERVAL_SECONDS", "60"))
+HEARTBEAT_VISIBILITY_TIMEOUT = int(os.getenv("HEARTBEAT_VISIBILITY_TIMEOUT", "180"))
+STALE_LOCK_SECONDS = int(os.getenv("STALE_LOCK_SECONDS", "600"))
+
+# Single-flight lease duration. Kept short and renewed by the heartbeat, so a crashed
+# invocation's lease lapses after a few missed beats instead of blocking redeliveries.
+TASK_LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", str(3 * HEARTBEAT_INTERVAL_SECONDS)))
+
 # Check if running in Lambda (production)
 def is_lambda_environment():
     """Check if running in AWS Lambda environment."""
@@ -155,9 +216,41 @@ def load_schemas():
     else:
         return load_local_schemas()
 
-def load_from_supabase(application_id):
+def download_to_spooled_file(bucket, path):
+    """
+    Stream a storage object into a spooled temp file.
+    The file stays in memory up to DOCUMENT_SPOOL_MAX_BYTES and rolls over to disk beyond that.
+    Returns (file, size_in_bytes) with the file positioned at the start.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=DOCUMENT_SPOOL_MAX_BYTES)
+    try:
+        signed = supabase.storage.from_(bucket).create_signed_url(path, 300)
+        signed_url = signed.get('signedURL') or signed.get('signedUrl')
+        with httpx.stream('GET', signed_url, timeout=60) as response:
+            response.raise_for_status()
+            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_BYTES):
+                spooled.write(chunk)
+    except Exception as e:
+        logger.warning(f"Streaming download failed for {path}, falling back to full download: {e}")
+        spooled.seek(0)
+        spooled.truncate()
+        spooled.write(supabase.storage.from_(bucket).download(path))
+    
+    size = spooled.tell()
+    spooled.seek(0)
+    return spooled, size
+
+def close_documents(application_docs):
+    """Release spooled document files."""
+    for doc in application_docs:
+        if hasattr(doc.get('content'), 'close'):
+            doc['content'].close()
+
+def load_from_supabase(application_id, download_files=True):
     """
     Load application data and PDFs from Supabase.
+    Each document's 'content' is a spooled file object and 'size' its length in bytes.
+    With download_files=False only file metadata is loaded ('content' is None).
     """
     logger.info(f"Loading application data for {application_id}")
     
@@ -177,38 +270,85 @@ def load_from_supabase(application_id):
         bucket = file_meta.get('storage_bucket', 'application-files')
         path = file_meta['storage_path']
         
+        if not download_files:
+            application_docs.append({
+                'metadata': file_meta,
+                'content': None
+            })
+            continue
+        
         try:
             logger.info(f"Downloading file {path} from bucket {bucket}")
-            file_content = supabase.storage.from_(bucket).download(path)
+            file_content, file_size = download_to_spooled_file(bucket, path)
             application_docs.append({
                 'metadata': file_meta,
-                'content': file_content 
+                'content': file_content,
+                'size': file_size
             })
         except Exception as e:
             logger.error(f"Failed to download file {path}: {e}")
 
     return application_data, application_docs
 
-def extractor_call(pdfs, extraction_schema, extractor_prompt):
+def _document_size(doc):
+    """Raw size in bytes of a document whose content is bytes or a file object."""
+    if doc.get('size') is not None:
+        return doc['size']
+    content = doc['content']
+    if isinstance(content, (bytes, bytearray)):
+        return len(content)
+    position = content.tell()
+    content.seek(0, os.SEEK_END)
+    size = content.tell()
+    content.seek(position)
+    return size
+
+def _encode_document(doc):
+    """Base64-encode a document only when its request is being built."""
+    content = doc['content']
+    if isinstance(content, (bytes, bytearray)):
+        return base64.b64encode(content).decode('utf-8')
+    content.seek(0)
+    encoded = base64.b64encode(content.read()).decode('utf-8')
+    content.seek(0)
+    return encoded
+
+def pack_documents(pdfs, max_request_bytes=None):
     """
-    Calls Anthropic API to extract information from PDFs based on the schema.
+    Split documents into batches whose base64 payload stays under max_request_bytes.
+    Order is preserved; a single document over the ceiling is sent on its own.
+    """
+    max_request_bytes = max_request_bytes or EXTRACTION_REQUEST_MAX_BYTES
+    batches = []
+    current, current_bytes = [], 0
+    for doc in pdfs:
+        encoded_size = 4 * ((_document_size(doc) + 2) // 3)
+        if current and current_bytes + encoded_size > max_request_bytes:
+            batches.append(current)
+            current, current_bytes = [], 0
+        if encoded_size > max_request_bytes:
+            logger.warning(f"Document {doc['metadata'].get('storage_path')} ({encoded_size} bytes encoded) exceeds the extraction request ceiling")
+        current.append(doc)
+        current_bytes += encoded_size
+    if current:
+        batches.append(current)
+    return batches
+
+def build_extraction_messages(pdfs, extraction_schema, extractor_prompt):
+    """
+    Build the extractor request messages for one batch of documents.
     """
-    logger.info("Calling Extractor AI...")
-    
     # Prepare content for the message
     content = []
     
     # Add PDFs
     for doc in pdfs:
-        # Encode PDF content to base64
-        pdf_b64 = base64.b64encode(doc['content']).decode('utf-8')
-        
         content.append({
             "type": "document",
             "source": {
                 "type": "base64",
                 "media_type": "application/pdf",
-                "data": pdf_b64
+                "data": _encode_document(doc)
             }
         })
 
@@ -218,13 +358,51 @@ def extractor_call(pdfs, extraction_schema, extractor_prompt):
         "text": f"{extractor_prompt}\n\n This is extraction_schema.json: {json.dumps(extraction_schema, indent=2)}"
     })
 
-    messages = [
+    return [
         {
             "role": "user",
             "content": content
         }
     ]
 
+def merge_extraction_outputs(base, extra):
+    """
+    Merge the extractor output of one document batch into another.
+    Lists are concatenated (without duplicates), objects merged, page counts summed.
+    """
+    for key, value in extra.items():
+        if key not in base or base[key] in (None, '', [], {}):
+            base[key] = value
+        elif isinstance(base[key], dict) and isinstance(value, dict):
+            merge_extraction_outputs(base[key], value)
+        elif isinstance(base[key], list) and isinstance(value, list):
+            base[key] = base[key] + [item for item in value if item not in base[key]]
+        elif key == 'total_pages_processed' and isinstance(base[key], (int, float)) and isinstance(value, (int, float)):
+            base[key] += value
+    return base
+
+def extractor_call(pdfs, extraction_schema, extractor_prompt):
+    """
+    Calls Anthropic API to extract information from PDFs based on the schema.
+    Documents are packed into as many requests as needed to stay under EXTRACTION_REQUEST_MAX_BYTES.
+    """
+    batches = pack_documents(pdfs)
+    if len(batches) > 1:
+        logger.info(f"Splitting {len(pdfs)} document(s) into {len(batches)} extractor requests")
+    
+    result = {}
+    for batch in batches:
+        merge_extraction_outputs(result, _extract_batch(batch, extraction_schema, extractor_prompt))
+    return result
+
+def _extract_batch(pdfs, extraction_schema, extractor_prompt):
+    """
+    Run one extractor request for a batch of documents.
+    """
+    logger.info("Calling Extractor AI...")
+    
+    messages = build_extraction_messages(pdfs, extraction_schema, extractor_prompt)
+
     # Retry logic
     max_retries = 2
     for attempt in range(max_retries):
@@ -258,14 +436,12 @@ def extractor_call(pdfs, extraction_schema, extractor_prompt):
                 raise
             time.sleep(1)  # Brief delay before retry
 
-def reasoning_call(extraction_schema, extractor_output, application_schema, application_data, reasoning_prompt, rules, reasoning_output_schema, has_extraction_output):
+def build_reasoning_prefix(extraction_schema, application_schema, application_data, reasoning_prompt, rules, reasoning_output_schema):
     """
-    Calls Anthropic API to reason about the application.
+    Build the part of the reasoning input that is known before extraction finishes, as cacheable blocks.
+    The first block (prompt, schemas, rules) is identical across applications; the second adds the application data.
     """
-    logger.info("Calling Reasoning AI...")
-    
-    # Build prompt conditionally based on whether extraction output exists
-    prompt_text = f"""
+    static_text = f"""
     {reasoning_prompt}
     
     application_schema.json:
@@ -274,26 +450,71 @@ def reasoning_call(extraction_schema, extractor_output, application_schema, appl
     {json.dumps(extraction_schema, indent=2)}
     reasoning_output_schema.json:
     {json.dumps(reasoning_output_schema, indent=2)}
-
-    Application Data:
-    {json.dumps(application_data, indent=2)}
     rules.md:
     {rules}
     """
+    application_text = f"""
+    Application Data:
+    {json.dumps(application_data, indent=2, default=str)}
+    """
+    return [
+        {"type": "text", "text": static_text, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": application_text, "cache_control": {"type": "ephemeral"}}
+    ]
+
+def warm_reasoning_cache(prefix_blocks):
+    """
+    Write the reasoning prefix to the prompt cache with a minimal request.
+    Runs alongside the extractor; failures only cost the speed-up.
+    """
+    try:
+        start = time.perf_counter()
+        response = anthropic_client.messages.create(
+            model=claude_model,
+            messages=[{"role": "user", "content": prefix_blocks}],
+            max_tokens=1
+        )
+        usage = response.usage
+        logger.info(
+            f"Warmed reasoning prompt cache in {time.perf_counter() - start:.1f}s "
+            f"(cache write: {getattr(usage, 'cache_creation_input_tokens', 0)}, cache read: {getattr(usage, 'cache_read_input_tokens', 0)} tokens)"
+        )
+    except Exception as e:
+        logger.warning(f"Failed to warm reasoning prompt cache: {e}")
+
+def reasoning_call(extraction_schema, extractor_output, application_schema, application_data, reasoning_prompt, rules, reasoning_output_schema, has_extraction_output, computed_facts=None):
+    """
+    Calls Anthropic API to reason about the application.
+    computed_facts: Optional Phase 0/1 figures from the rules engine, passed as authoritative.
+    """
+    logger.info("Calling Reasoning AI...")
     
+    # The prefix is cached; only the evidence below changes between calls for the same application
+    content = build_reasoning_prefix(
+        extraction_schema, application_schema, application_data, reasoning_prompt, rules, reasoning_output_schema
+    )
+    
+    # Build prompt conditionally based on whether extraction output exists
     if has_extraction_output:
-        prompt_text += f"""
+        evidence_text = f"""
     Extracted Data:
     {json.dumps(extractor_output, indent=2)}"""
     else:
-        prompt_text += f"""
+        evidence_text = f"""
     Extracted Data:
     No additional documents were uploaded - please review the application data and make a decision based on the information provided."""
 
+    if computed_facts:
+        evidence_text += f"""
+    Computed Facts (authoritative - deterministic Phase 0 and Phase 1 calculations from the earnings records; use these figures instead of recalculating them):
+    {json.dumps(computed_facts, indent=2)}"""
+
+    content.append({"type": "text", "text": evidence_text})
+
     messages = [
         {
             "role": "user",
-            "content": prompt_text
+            "content": content
         }
     ]
 
@@ -301,11 +522,16 @@ def reasoning_call(extraction_schema, extractor_output, application_schema, appl
     max_retries = 2
     for attempt in range(max_retries):
         try:
+            start = time.perf_counter()
             response = anthropic_client.messages.create(
                 model=claude_model,
                 messages=messages,
                 max_tokens=16000  # Reasoning output can be longer with phases analysis
             )
+            logger.info(
+                f"Reasoning call took {time.perf_counter() - start:.1f}s "
+                f"(cache read: {getattr(response.usage, 'cache_read_input_tokens', 0)} tokens)"
+            )
             
             # Extract JSON from response
             response_text = response.content[0].text
@@ -328,28 +554,550 @@ def reasoning_call(extraction_schema, extractor_output, application_schema, appl
                 raise
             time.sleep(1)  # Brief delay before retry
 
-def ai(application_id):
+# =============================================================================
+# Rules engine: deterministic Phase 0 (insured status) and Phase 1 (SGA) facts
+# =============================================================================
+
+# Earnings required for one quarter of coverage, by year (SSA published amounts)
+QUARTER_OF_COVERAGE_AMOUNTS = {
+    2000: 780, 2001: 830, 2002: 870, 2003: 890, 2004: 900,
+    2005: 920, 2006: 970, 2007: 1000, 2008: 1050, 2009: 1090,
+    2010: 1120, 2011: 1120, 2012: 1130, 2013: 1160, 2014: 1200,
+    2015: 1220, 2016: 1260, 2017: 1300, 2018: 1320, 2019: 1360,
+    2020: 1410, 2021: 1470, 2022: 1510, 2023: 1640, 2024: 1730,
+    2025: 1810
+}
+
+# Monthly SGA thresholds (non_blind, blind) by year; 2024/2025 match rules.md
+SGA_THRESHOLDS = {
+    2020: (1260, 2110), 2021: (1310, 2190), 2022: (1350, 2260),
+    2023: (1470, 2460), 2024: (1550, 2590), 2025: (1620, 2700)
+}
+
+FULL_RETIREMENT_AGE = 67
+
+def _lookup_by_year(table, year):
+    """Look up a per-year table, clamping to the first/last year we have."""
+    if year in table:
+        return table[year]
+    return table[min(table)] if year < min(table) else table[max(table)]
+
+def _parse_amount(value):
+    """Parse an earnings amount like 28500, "28500" or "$28,500.00". Returns float or None."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace('$', '').replace(',', '').strip())
+    except ValueError:
+        return None
+
+def _parse_date(value):
+    """Parse a YYYY-MM-DD (or ISO timestamp) string. Returns date or None."""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+def _age_on(birthdate, on_date):
+    return on_date.year - birthdate.year - ((on_date.month, on_date.day) < (birthdate.month, birthdate.day))
+
+def _jsonb_list(value):
+    """JSONB columns written by the applicant backend may arrive as JSON strings."""
+    if isinstance(value, str):
+        value = json.loads(value) if value else []
+    return value if isinstance(value, list) else []
+
+def _quarter_index(year, quarter):
+    return year * 4 + quarter - 1
+
+def _credits_in_window(credits_by_year, end_year, end_quarter, num_quarters):
+    """
+    Count quarters of coverage in the num_quarters-quarter period ending with (end_year, end_quarter).
+    Annual credits are capped at the number of that year's quarters inside the period.
+    """
+    end_index = _quarter_index(end_year, end_quarter)
+    start_index = end_index - num_quarters + 1
+    total = 0
+    for year in range(start_index // 4, end_year + 1):
+        quarters_in_window = sum(
+            1 for q in range(1, 5) if start_index <= _quarter_index(year, q) <= end_index
+        )
+        total += min(credits_by_year.get(year, 0), quarters_in_window)
+    return total
+
+def merge_earnings_records(application_data, extractor_output=None):
+    """
+    Merge yearly earnings from documents (W-2 / SSA statement) and the application.
+    An SSA earnings statement already reports the year's total, so it is used as-is when present;
+    otherwise the year's W-2s (one per employer) are summed. Document amounts take precedence
+    over self-reported amounts for the same year.
+    Returns {year: {"amount": float, "source": str}}.
+    """
+    earnings = {}
+    for entry in _jsonb_list(application_data.get('earnings_history')):
+        if not isinstance(entry, dict):
+            continue
+        year = _parse_amount(entry.get('year'))
+        amount = _parse_amount(entry.get('total_earnings'))
+        if year is not None and amount is not None:
+            earnings[int(year)] = {"amount": amount, "source": "application"}
+
+    statements = {}
+    w2s = {}
+    # The extractor leaves missing sections null (e.g. medical-only uploads)
+    administrative_data = (extractor_output or {}).get('administrative_data') or {}
+    if not isinstance(administrative_data, dict):
+        administrative_data = {}
+    extracted = administrative_data.get('earnings_record') or []
+    for entry in extracted if isinstance(extracted, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        year = _parse_amount(entry.get('year'))
+        amount = _parse_amount(entry.get('amount'))
+        source = entry.get('source_document') or "document"
+        if year is None or amount is None or year <= 0 or not isinstance(source, str):
+            continue
+        if 'ssa' in source.lower() or 'statement' in source.lower():
+            # Several statements may cover the same year; they report the same total
+            if amount >= statements.get(int(year), {}).get("amount", 0):
+                statements[int(year)] = {"amount": amount, "source": source}
+        else:
+            w2 = w2s.setdefault(int(year), {"amount": 0.0, "sources": []})
+            w2["amount"] += amount
+            w2["sources"].append(source)
+
+    for year, w2 in w2s.items():
+        earnings[year] = {"amount": w2["amount"], "source": ", ".join(dict.fromkeys(w2["sources"]))}
+    earnings.update(statements)
+
+    return earnings
+
+def compute_insured_status(earnings, onset, birthdate):
+    """
+    Phase 0 arithmetic: quarters of coverage, 20/40 (or younger-worker) test at onset, and date last insured.
+    """
+    years = sorted(earnings)
+    credits = [min(4, int(earnings[y]["amount"] // _lookup_by_year(QUARTER_OF_COVERAGE_AMOUNTS, y))) for y in years]
+    credits_by_year = dict(zip(years, credits))
+
+    facts = {
+        "quarters_of_coverage_by_year": {str(y): c for y, c in credits_by_year.items()},
+        "total_quarters_of_coverage": sum(credits),
+        "insured_status_rule": None,
+        "quarters_in_test_period": None,
+        "quarters_required": None,
+        "insured_at_onset": None,
+        "date_last_insured": None,
+    }
+
+    if onset:
+        onset_quarter = (onset.month - 1) // 3 + 1
+        age_at_onset = _age_on(birthdate, onset) if birthdate else None
+        if age_at_onset is not None and age_at_onset < 31:
+            # 20 CFR 404.130(c): half the quarters since age 21 (minimum 6 of the last 12)
+            turned_21 = _quarter_index(birthdate.year + 21, (birthdate.month - 1) // 3 + 1)
+            elapsed = _quarter_index(onset.year, onset_quarter) - turned_21
+            period = max(12, elapsed - elapsed % 2)
+            facts["insured_status_rule"] = "younger_worker"
+            facts["quarters_required"] = max(6, period // 2)
+        else:
+            period = 40
+            facts["insured_status_rule"] = "20/40"
+            facts["quarters_required"] = 20
+        facts["quarters_in_test_period"] = _credits_in_window(credits_by_year, onset.year, onset_quarter, period)
+        facts["insured_at_onset"] = facts["quarters_in_test_period"] >= facts["quarters_required"]
+
+    # Date last insured under 20/40, assuming no earnings after the last reported year
+    if years:
+        last_insured = None
+        for year in range(years[0], years[-1] + 11):
+            for quarter in range(1, 5):
+                if _credits_in_window(credits_by_year, year, quarter, 40) >= 20:
+                    last_insured = (year, quarter)
+        if last_insured:
+            year, quarter = last_insured
+            facts["date_last_insured"] = date(year, quarter * 3, 31 if quarter in (1, 4) else 30).isoformat()
+
+    return facts
+
+def compute_sga(earnings, onset, application_data):
+    """
+    Phase 1 arithmetic: average monthly earnings for each full year after onset, compared against SGA.
+    """
+    post_onset = []
+    if onset:
+        for year in sorted(y for y in earnings if y > onset.year):
+            non_blind, blind = _lookup_by_year(SGA_THRESHOLDS, year)
+            monthly = round(earnings[year]["amount"] / 12, 2)
+            post_onset.append({
+                "year": year,
+                "monthly_earnings": monthly,
+                "sga_threshold_non_blind": non_blind,
+                "sga_threshold_blind": blind,
+                "exceeds_sga_non_blind": monthly > non_blind,
+                "source": earnings[year]["source"]
+            })
+
+    # Jobs without an end date are the applicant's current work
+    current_jobs = [
+        job for job in _jsonb_list(application_data.get('employment_history'))
+        if isinstance(job, dict) and not job.get('employment_end_date')
+    ]
+
+    # A job's total_earnings is its lifetime total, not a rate, so no monthly figure is derived from it
+    return {
+        "post_onset_monthly_earnings": post_onset,
+        "currently_working": bool(current_jobs),
+    }
+
+def precompute_eligibility_facts(application_data, extractor_output=None, today=None):
+    """
+    Deterministically compute Phase 0 and Phase 1 figures from earnings records and application fields.
+    These are injected into the reasoning input as authoritative facts.
+    Returns None if the inputs can't be used; reasoning then proceeds without them.
+    """
+    try:
+        return _compute_eligibility_facts(application_data, extractor_output, today)
+    except Exception as e:
+        logger.warning(f"Could not precompute eligibility facts, continuing without them: {e}")
+        # Don't raise - the facts are an aid to the reasoning call, not a requirement
+        return None
+
+def _compute_eligibility_facts(application_data, extractor_output, today):
+    today = today or date.today()
+    birthdate = _parse_date(application_data.get('birthdate'))
+    onset = _parse_date(application_data.get('date_condition_began_affecting_work'))
+    earnings = merge_earnings_records(application_data, extractor_output)
+
+    facts = {
+        "computed_on": today.isoformat(),
+        "alleged_onset_date": onset.isoformat() if onset else None,
+        "age_today": _age_on(birthdate, today) if birthdate else None,
+        "age_at_onset": _age_on(birthdate, onset) if birthdate and onset else None,
+        "under_full_retirement_age": _age_on(birthdate, today) < FULL_RETIREMENT_AGE if birthdate else None,
+        "earnings_years_used": {str(y): e for y, e in sorted(earnings.items())},
+    }
+    facts["phase_0"] = compute_insured_status(earnings, onset, birthdate)
+    facts["phase_1"] = compute_sga(earnings, onset, application_data)
+    return facts
+
+def short_circuit_decision(facts, today=None):
+    """
+    Return a complete reasoning output for clear-cut cases that need no model call, otherwise None.
+    Currently: recent post-onset earnings far above even the blind SGA threshold (Phase 1 FAIL).
+    """
+    if not facts:
+        return None
+    today = today or date.today()
+    recent = [
+        entry for entry in facts["phase_1"]["post_onset_monthly_earnings"]
+        if entry["year"] >= today.year - 1
+    ]
+    if not recent:
+        return None
+
+    latest = recent[-1]
+    limit = latest["sga_threshold_blind"] * SGA_SHORT_CIRCUIT_MULTIPLIER
+    if latest["monthly_earnings"] < limit:
+        return None
+
+    not_evaluated = {
+        "status": "WARN",
+        "reasoning": "Not evaluated: the sequential evaluation stops at Phase 1 when the claimant is engaging in SGA.",
+        "citations": ["20 CFR § 404.1520(a)(4)(i)"],
+        "evidence": []
+    }
+    phase_0 = facts["phase_0"]
+    return {
+        "overall_recommendation": "DENY",
+        "confidence_score": 0.95,
+        "summary": (
+            f"Earnings of ${latest['monthly_earnings']:,.2f}/month in {latest['year']}, after the alleged onset date "
+            f"of {facts['alleged_onset_date']}, are far above the SGA threshold of ${latest['sga_threshold_non_blind']:,}/month. "
+            "The claimant is engaging in substantial gainful activity and is not disabled under Step 1."
+        ),
+        "phases": {
+            "phase_0": {
+                "status": "PASS" if phase_0["insured_at_onset"] else "WARN",
+                "reasoning": (
+                    f"{phase_0['quarters_in_test_period']} quarters of coverage in the test period "
+                    f"({phase_0['insured_status_rule']} rule, {phase_0['quarters_required']} required). "
+                    f"Date last insured: {phase_0['date_last_insured']}."
+                ),
+                "citations": ["42 U.S.C. § 423(c)"],
+                "evidence": ["earnings_record", "earnings_history"]
+            },
+            "phase_1": {
+                "status": "FAIL",
+                "reasoning": (
+                    f"Average monthly earnings of ${latest['monthly_earnings']:,.2f} in {latest['year']} exceed the "
+                    f"{latest['year']} SGA thresholds (${latest['sga_threshold_non_blind']:,} non-blind, "
+                    f"${latest['sga_threshold_blind']:,} blind)."
+                ),
+                "citations": ["42 U.S.C. § 423(d)(4)(A)", "20 CFR § 404.1574"],
+                "evidence": [f"{latest['year']} earnings ({latest['source']})"],
+                "calculated_monthly_earnings": latest["monthly_earnings"]
+            },
+            "phase_2": dict(not_evaluated, identified_impairments=[]),
+            "phase_3": dict(not_evaluated, considered_listings=[]),
+            "phase_4": dict(not_evaluated),
+            "phase_5": dict(not_evaluated)
+        },
+        "missing_information": [],
+        "suggested_actions": [
+            "Confirm current work activity and earnings with the claimant",
+            "Check for IRWE, subsidies or special conditions that could reduce countable earnings"
+        ]
+    }
+
+# =============================================================================
+# Demo replay cache: recorded results for the sample application's documents
+# =============================================================================
+
+# Application fields that differ between demo sessions without changing the evaluation
+DEMO_VOLATILE_FIELDS = {
+    'id', 'applicant_id', 'demo_session_id', 'status', 'status_changed_at', 'status_notes',
+    'created_at', 'updated_at', 'submitted_at', 'version', 'current_step', 'steps_completed'
+}
+
+def _strip_volatile(value):
+    """Drop per-session fields (ids, timestamps, file references, previous AI output) for fingerprinting."""
+    if isinstance(value, dict):
+        return {
+            k: _strip_volatile(v) for k, v in value.items()
+            if k not in DEMO_VOLATILE_FIELDS and not k.startswith('reasoning_') and not k.endswith('file_id')
+        }
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    if isinstance(value, str) and value[:1] in '[{':
+        # JSONB columns written by the applicant backend may arrive as JSON strings
+        try:
+            return _strip_volatile(json.loads(value))
+        except ValueError:
+            return value
+    return value
+
+def _hash_document(doc):
+    """SHA-256 of a document's content, streamed from its spooled file."""
+    digest = hashlib.sha256()
+    content = doc['content']
+    if isinstance(content, (bytes, bytearray)):
+        digest.update(content)
+    else:
+        content.seek(0)
+        for chunk in iter(lambda: content.read(DOWNLOAD_CHUNK_BYTES), b''):
+            digest.update(chunk)
+        content.seek(0)
+    return digest.hexdigest()
+
+def demo_document_set_hash(application_data, application_docs):
+    """
+    Identify a demo submission by the content of its documents plus its application data
+    (without per-session fields), so edited demo applications are never replayed.
+    """
+    digest = hashlib.sha256()
+    for doc_hash in sorted(_hash_document(doc) for doc in application_docs):
+        digest.update(doc_hash.encode('utf-8'))
+    digest.update(json.dumps(_strip_volatile(application_data), sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+def pipeline_version_hash(prompts, schemas):
+    """Hash of everything that shapes the AI output; a change invalidates recorded demo results."""
+    digest = hashlib.sha256(claude_model.encode('utf-8'))
+    for prompt in prompts:
+        digest.update(prompt.encode('utf-8'))
+    for schema in schemas:
+        digest.update(json.dumps(schema, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def _rewrite_strings(value, replacements):
+    """Replace recorded ids/dates with the current application's in every string of an output."""
+    if isinstance(value, dict):
+        return {k: _rewrite_strings(v, replacements) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rewrite_strings(v, replacements) for v in value]
+    if isinstance(value, str):
+        for old, new in replacements.items():
+            if old and new:
+                value = value.replace(old, new)
+    return value
+
+def load_demo_replay(document_set_hash, version_hash):
+    """
+    Fetch the recorded demo result for this document set and pipeline version.
+    Returns the recording or None.
+    """
+    key = (document_set_hash, version_hash)
+    if key in demo_replay_memo:
+        return demo_replay_memo[key]
+    try:
+        response = supabase.table('demo_replay_cache')\
+            .select('*')\
+            .eq('document_set_hash', document_set_hash)\
+            .eq('version_hash', version_hash)\
+            .execute()
+        if response.data:
+            demo_replay_memo[key] = response.data[0]
+            return response.data[0]
+    except Exception as e:
+        logger.warning(f"Failed to load demo replay recording: {e}")
+    return None
+
+def save_demo_replay(document_set_hash, version_hash, application_id, application_data, extractor_output, reasoning_output):
+    """
+    Record (or refresh, after a prompt/schema change) the result for a demo document set.
+    """
+    recording = {
+        'document_set_hash': document_set_hash,
+        'version_hash': version_hash,
+        'recorded_application_id': str(application_id),
+        'recorded_submission_date': (application_data.get('submitted_at') or '')[:10] or None,
+        'extractor_output': extractor_output,
+        'reasoning_output': reasoning_output,
+        'updated_at': 'now()'
+    }
+    try:
+        supabase.table('demo_replay_cache').upsert(recording, on_conflict='document_set_hash').execute()
+        demo_replay_memo[(document_set_hash, version_hash)] = recording
+        logger.info(f"[DEMO] Recorded replay result for document set {document_set_hash[:12]}")
+    except Exception as e:
+        logger.warning(f"[DEMO] Failed to record replay result: {e}")
+        # Don't raise - the next demo simply runs the full pipeline
+
+def replay_demo_result(recording, application_id, application_data):
+    """Rewrite a recorded reasoning output for the current demo application."""
+    replacements = {
+        recording.get('recorded_application_id'): str(application_id),
+        recording.get('recorded_submission_date'): (application_data.get('submitted_at') or '')[:10],
+    }
+    reasoning_output = _rewrite_strings(recording['reasoning_output'], replacements)
+    reasoning_output['application_id'] = str(application_id)
+    if application_data.get('submitted_at'):
+        reasoning_output['submission_date'] = application_data['submitted_at'][:10]
+    return reasoning_output
+
+def ai(application_id, task_id=None):
+    """
+    Run extraction and reasoning for an application.
+    When task_id is given, stage outputs are checkpointed on the task so a retry resumes where it failed.
+    """
+    checkpoint = load_task_checkpoint(task_id) if task_id else {}
+    completed_stages = checkpoint.get('completed_stages', [])
+    if 'reasoning_done' in completed_stages:
+        logger.info(f"Resuming task {task_id} from checkpoint: skipping document download, extraction and reasoning")
+        return checkpoint['reasoning_output']
+
     extractor_prompt, reasoning_prompt, rules = load_prompts()
     application_schema, extraction_schema, reasoning_output_schema = load_schemas()
-    application_data, application_docs = load_from_supabase(application_id)
 
-    # Check if there are any documents to process
-    if not application_docs:
-        logger.info("No documents found. Skipping extractor call and proceeding directly to reasoning call.")
-        extractor_output = None
-        has_extraction_output = False
-    else:
-        logger.info(f"Found {len(application_docs)} document(s). Running extractor call...")
-        extractor_output = extractor_call(application_docs, extraction_schema, extractor_prompt)
-        logger.info("Extractor call completed successfully.")
-        has_extraction_output = True
-    
-    logger.info("Proceeding to reasoning call...")
-    reasoning_output = reasoning_call(
-        extraction_schema, extractor_output, application_schema, application_data, 
-        reasoning_prompt, rules, reasoning_output_schema, has_extraction_output
-    )
-    
+    # PDFs are only needed if extraction has not been checkpointed yet
+    extraction_checkpointed = 'extraction_done' in completed_stages
+    application_data, application_docs = load_from_supabase(application_id, download_files=not extraction_checkpointed)
+    document_ids = sorted(str(doc['metadata'].get('id')) for doc in application_docs)
+    if extraction_checkpointed and checkpoint.get('document_ids') != document_ids:
+        logger.warning(f"Documents for application {application_id} changed since the extraction checkpoint. Re-extracting.")
+        extraction_checkpointed = False
+        application_data, application_docs = load_from_supabase(application_id)
+    # Spooled documents are closed on every exit path, including errors
+    try:
+        if task_id and not extraction_checkpointed:
+            save_task_checkpoint(task_id, 'documents_loaded', document_ids=document_ids)
+
+        # Demo fast path: known sample document sets replay a recorded result
+        demo_replay_key = None
+        if DEMO_REPLAY_ENABLED and application_data.get('demo_session_id') and application_docs and not extraction_checkpointed:
+            demo_replay_key = (
+                demo_document_set_hash(application_data, application_docs),
+                pipeline_version_hash(
+                    (extractor_prompt, reasoning_prompt, rules),
+                    (application_schema, extraction_schema, reasoning_output_schema)
+                )
+            )
+            recording = load_demo_replay(*demo_replay_key)
+            if recording:
+                logger.info(f"[DEMO] Replaying recorded result for application {application_id}. Model calls avoided: 2")
+                reasoning_output = replay_demo_result(recording, application_id, application_data)
+                if task_id:
+                    save_task_checkpoint(task_id, 'reasoning_done', reasoning_output=reasoning_output)
+                return reasoning_output
+
+        # Clear-cut outcomes from the application alone skip both model calls
+        computed_facts = precompute_eligibility_facts(application_data)
+        reasoning_output = short_circuit_decision(computed_facts)
+        if reasoning_output:
+            calls_avoided = 2 if application_docs else 1
+            logger.info(f"Rules engine decided application {application_id} without the model. Model calls avoided: {calls_avoided}")
+            reasoning_output = finalize_reasoning_output(reasoning_output, application_id, application_data)
+            if task_id:
+                save_task_checkpoint(task_id, 'reasoning_done', reasoning_output=reasoning_output)
+            return reasoning_output
+
+        # Check if there are any documents to process
+        if not application_docs:
+            logger.info("No documents found. Skipping extractor call and proceeding directly to reasoning call.")
+            extractor_output = None
+            has_extraction_output = False
+        elif extraction_checkpointed:
+            logger.info(f"Resuming task {task_id} from checkpoint: skipping download and extraction of {len(application_docs)} document(s)")
+            extractor_output = checkpoint['extractor_output']
+            has_extraction_output = True
+            computed_facts = precompute_eligibility_facts(application_data, extractor_output)
+        else:
+            logger.info(f"Found {len(application_docs)} document(s). Running extractor call...")
+            extraction_start = time.perf_counter()
+            warm_executor = None
+            if PIPELINED_REASONING:
+                # Everything before the extracted evidence is already known: cache it while the extractor runs
+                warm_executor = ThreadPoolExecutor(max_workers=1)
+                warm_executor.submit(warm_reasoning_cache, build_reasoning_prefix(
+                    extraction_schema, application_schema, application_data, reasoning_prompt, rules, reasoning_output_schema
+                ))
+            try:
+                extractor_output = extractor_call(application_docs, extraction_schema, extractor_prompt)
+            finally:
+                close_documents(application_docs)
+                if warm_executor:
+                    # Don't wait: reasoning can start as soon as extraction output arrives
+                    warm_executor.shutdown(wait=False)
+            logger.info(f"Extractor call completed successfully in {time.perf_counter() - extraction_start:.1f}s.")
+            has_extraction_output = True
+            if task_id:
+                save_task_checkpoint(task_id, 'extraction_done', extractor_output=extractor_output)
+
+            # Recompute with verified earnings from the documents
+            computed_facts = precompute_eligibility_facts(application_data, extractor_output)
+            reasoning_output = short_circuit_decision(computed_facts)
+            if reasoning_output:
+                logger.info(f"Rules engine decided application {application_id} without the reasoning call. Model calls avoided: 1")
+                reasoning_output = finalize_reasoning_output(reasoning_output, application_id, application_data)
+                if task_id:
+                    save_task_checkpoint(task_id, 'reasoning_done', reasoning_output=reasoning_output)
+                return reasoning_output
+        
+        logger.info("Proceeding to reasoning call...")
+        reasoning_output = reasoning_call(
+            extraction_schema, extractor_output, application_schema, application_data, 
+            reasoning_prompt, rules, reasoning_output_schema, has_extraction_output,
+            computed_facts=computed_facts
+        )
+        
+        reasoning_output = finalize_reasoning_output(reasoning_output, application_id, application_data)
+        if task_id:
+            save_task_checkpoint(task_id, 'reasoning_done', reasoning_output=reasoning_output)
+        if demo_replay_key:
+            save_demo_replay(*demo_replay_key, application_id, application_data, extractor_output, reasoning_output)
+        return reasoning_output
+    finally:
+        close_documents(application_docs)
+
+def finalize_reasoning_output(reasoning_output, application_id, application_data):
+    """
+    Fill required reasoning_output_schema fields that the AI (or rules engine) left out.
+    """
     # Ensure required fields from reasoning_output_schema are populated
     # These should come from the AI, but we can add fallbacks from application_data
     if 'application_id' not in reasoning_output:
@@ -389,10 +1137,11 @@ def update_db_with_ai_output(output, application_id, application_data):
         logger.error(f"Failed to update database: {e}")
         raise
 
-def assign_case_to_caseworker(application_id):
+def assign_case_to_caseworker(application_id, priority=0):
     """
     Assign a case to an available caseworker, distributing evenly.
     For demo applications, always assign to demo caseworker.
+    priority is the scheduling priority computed for the application's AI task.
     Returns the assigned caseworker_id or None if no caseworkers available.
     """
     logger.info(f"Assigning application {application_id} to a caseworker")
@@ -414,7 +1163,7 @@ def assign_case_to_caseworker(application_id):
             assignment_response = supabase.rpc('assign_reviewer', {
                 'p_application_id': application_id,
                 'p_reviewer_id': demo_caseworker_id,
-                'p_priority': 0
+                'p_priority': priority
             }).execute()
             
             if assignment_response.data:
@@ -465,7 +1214,7 @@ def assign_case_to_caseworker(application_id):
             assignment_response = supabase.rpc('assign_reviewer', {
                 'p_application_id': application_id,
                 'p_reviewer_id': selected_caseworker_id,
-                'p_priority': 0
+                'p_priority': priority
             }).execute()
         except Exception as e:
             # Fallback: if migration not applied, try with NULL assigned_by
@@ -475,7 +1224,7 @@ def assign_case_to_caseworker(application_id):
                     'p_application_id': application_id,
                     'p_reviewer_id': selected_caseworker_id,
                     'p_assigned_by': None,
-                    'p_priority': 0
+                    'p_priority': priority
                 }).execute()
             else:
                 raise
@@ -490,7 +1239,7 @@ def assign_case_to_caseworker(application_id):
         logger.error(f"Error assigning application {application_id} to caseworker {selected_caseworker_id}: {e}")
         return None
 
-def orchestrate_assignment(application_id):
+def orchestrate_assignment(application_id, priority=0):
     """
     Orchestrate case assignment to caseworkers.
     """
@@ -513,16 +1262,17 @@ def orchestrate_assignment(application_id):
         return {"result": "already_assigned"}
     
     # Assign to caseworker
-    assigned_caseworker_id = assign_case_to_caseworker(application_id)
+    assigned_caseworker_id = assign_case_to_caseworker(application_id, priority)
     
     if assigned_caseworker_id:
         return {"result": "assigned", "caseworker_id": str(assigned_caseworker_id)}
     else:
         return {"result": "no_caseworkers_available"}
 
-def send_orchestration_task_to_sqs(application_id):
+def send_orchestration_task_to_sqs(application_id, priority=0):
     """
-    Send an orchestration task to SQS queue.
+    Send an orchestration task to SQS queue (orchestration always runs in the fast lane).
+    priority is carried through to assign_reviewer.
     Returns True if successful, False otherwise.
     """
     if not sqs_client or not SQS_QUEUE_URL:
@@ -533,8 +1283,11 @@ def send_orchestration_task_to_sqs(application_id):
         message_body = {
             "task_type": "orchestration",
             "application_id": application_id,
+            "lane": "fast",
+            "enqueued_at": int(time.time() * 1000),
             "payload": {
-                "application_id": application_id
+                "application_id": application_id,
+                "priority": priority
             }
         }
         
@@ -572,10 +1325,18 @@ def process_task(task_data, task_id=None):
         if not application_id:
             raise Exception(f"No application_id provided in AI task")
         
-        # Load application data to pass to update function
-        application_data, _ = load_from_supabase(application_id)
-        out = ai(application_id)
-        update_db_with_ai_output(out, application_id, application_data)
+        ai_start = time.perf_counter()
+        out = ai(application_id, task_id)
+        logger.info(f"AI pipeline for application {application_id} took {time.perf_counter() - ai_start:.1f}s (pipelined reasoning: {PIPELINED_REASONING})")
+        
+        if task_id and 'db_written' in load_task_checkpoint(task_id).get('completed_stages', []):
+            logger.info(f"Resuming task {task_id} from checkpoint: reasoning output already written to database")
+        else:
+            # Load application data (without re-downloading files) to pass to update function
+            application_data, _ = load_from_supabase(application_id, download_files=False)
+            update_db_with_ai_output(out, application_id, application_data)
+            if task_id:
+                save_task_checkpoint(task_id, 'db_written')
         
         logger.info(f"AI task {task_id or 'unknown'} completed successfully")
         return {"result": "success", "next_task": "orchestration"}
@@ -585,7 +1346,7 @@ def process_task(task_data, task_id=None):
         if not application_id:
             raise Exception(f"No application_id provided in orchestration task")
         
-        result = orchestrate_assignment(application_id)
+        result = orchestrate_assignment(application_id, payload.get('priority', 0))
         logger.info(f"Orchestration task {task_id or 'unknown'} completed: {result}")
         return result
         
@@ -596,6 +1357,77 @@ def process_task(task_data, task_id=None):
         logger.warning(f"Unknown task type: {task_type}")
         return {"result": "unknown_task_type"}
 
+def should_profile_task(task_data):
+    """Profile when the message asks for it, or for a PROFILE_SAMPLE_RATE fraction of tasks."""
+    if task_data.get('profile') or task_data.get('payload', {}).get('profile'):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def run_task(task_data, task_id=None):
+    """
+    Process a task, under cProfile and tracemalloc if profiling was requested for it.
+    When profiling is off this is a plain call to process_task().
+    """
+    if not should_profile_task(task_data):
+        return process_task(task_data, task_id)
+    
+    logger.info(f"Profiling task {task_id or 'unknown'}")
+    profiler = cProfile.Profile()
+    tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            return process_task(task_data, task_id)
+        finally:
+            profiler.disable()
+    finally:
+        elapsed = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        write_task_profile(task_id or f"unknown-{uuid.uuid4()}", task_data, profiler, snapshot, elapsed, peak_bytes)
+
+def write_task_profile(task_id, task_data, profiler, snapshot, elapsed, peak_bytes):
+    """
+    Write profile.pstats, tracemalloc.snapshot and a readable summary.txt for a task
+    to PROFILE_OUTPUT/<task_id>/ (local directory or S3 prefix).
+    """
+    try:
+        stats_stream = io.StringIO()
+        pstats.Stats(profiler, stream=stats_stream).sort_stats('cumulative').print_stats(40)
+        top_allocations = snapshot.statistics('lineno')[:25]
+        summary = (
+            f"task_id: {task_id}\n"
+            f"task_type: {task_data.get('task_type')}\n"
+            f"application_id: {task_data.get('application_id') or task_data.get('payload', {}).get('application_id')}\n"
+            f"elapsed_seconds: {elapsed:.3f}\n"
+            f"peak_traced_memory_mb: {peak_bytes / 1024 / 1024:.1f}\n\n"
+            f"Top allocations (by line):\n" + "\n".join(str(stat) for stat in top_allocations) +
+            f"\n\nCumulative time:\n{stats_stream.getvalue()}"
+        )
+        
+        is_s3 = PROFILE_OUTPUT.startswith('s3://')
+        local_dir = tempfile.mkdtemp(prefix='task-profile-') if is_s3 else os.path.join(PROFILE_OUTPUT, str(task_id))
+        os.makedirs(local_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(local_dir, 'profile.pstats'))
+        snapshot.dump(os.path.join(local_dir, 'tracemalloc.snapshot'))
+        with open(os.path.join(local_dir, 'summary.txt'), 'w') as f:
+            f.write(summary)
+        
+        if is_s3:
+            bucket, _, prefix = PROFILE_OUTPUT[len('s3://'):].partition('/')
+            s3_client = boto3.client('s3', region_name=S3_REGION)
+            for name in ('profile.pstats', 'tracemalloc.snapshot', 'summary.txt'):
+                key = '/'.join(part for part in (prefix.strip('/'), str(task_id), name) if part)
+                s3_client.upload_file(os.path.join(local_dir, name), bucket, key)
+            shutil.rmtree(local_dir, ignore_errors=True)
+        
+        logger.info(f"Profile for task {task_id} written to {PROFILE_OUTPUT}/{task_id} ({elapsed:.1f}s, peak {peak_bytes / 1024 / 1024:.1f} MB traced)")
+    except Exception as e:
+        logger.warning(f"Failed to write profile for task {task_id}: {e}")
+        # Don't raise - profiling must never fail the task
+
 def find_or_create_task_record(task_data):
     """
     Find existing task record in processing_queue or create one if not found.
@@ -614,14 +1446,15 @@ def find_or_create_task_record(task_data):
         except Exception as e:
             logger.warning(f"Could not find task with id {task_id}: {e}")
     
-    # Otherwise, try to find by application_id + task_type + pending status
+    # Otherwise, try to find by application_id + task_type among unfinished records
+    # (processing/failed records belong to earlier attempts of the same message and hold its checkpoint)
     if application_id and task_type:
         try:
             response = supabase.table('processing_queue')\
                 .select('id')\
                 .eq('application_id', application_id)\
                 .eq('task_type', task_type)\
-                .eq('status', 'pending')\
+                .in_('status', ['pending', 'processing', 'failed'])\
                 .order('created_at', desc=True)\
                 .limit(1)\
                 .execute()
@@ -648,6 +1481,28 @@ def find_or_create_task_record(task_data):
     
     return None
 
+def find_completed_task(application_id, task_type, since_ms):
+    """
+    Find a processing_queue record for (application_id, task_type) completed at or after since_ms
+    (epoch milliseconds). Returns the task_id, or None if there is none.
+    """
+    since = datetime.fromtimestamp(since_ms / 1000, tz=timezone.utc).isoformat()
+    try:
+        response = supabase.table('processing_queue')\
+            .select('id')\
+            .eq('application_id', application_id)\
+            .eq('task_type', task_type)\
+            .eq('status', 'completed')\
+            .gte('updated_at', since)\
+            .order('updated_at', desc=True)\
+            .limit(1)\
+            .execute()
+        if response.data:
+            return response.data[0]['id']
+    except Exception as e:
+        logger.warning(f"Could not look up completed {task_type} task for application {application_id}: {e}")
+    return None
+
 def update_task_status(task_id, status, error_message=None, result=None):
     """
     Update the status of a task in processing_queue table.
@@ -685,51 +1540,372 @@ def update_task_status(task_id, status, error_message=None, result=None):
         logger.error(f"Failed to update task {task_id} status: {e}")
         # Don't raise - this is non-critical for processing
 
-def process_sqs_message(record):
+def load_task_checkpoint(task_id):
+    """
+    Load the stage checkpoint stored in the task's processing_queue payload.
+    Returns {} if there is none.
+    """
+    try:
+        current_task = supabase.table('processing_queue').select('payload').eq('id', task_id).execute()
+        current_payload = current_task.data[0].get('payload', {}) if current_task.data else {}
+        if isinstance(current_payload, str):
+            current_payload = json.loads(current_payload) if current_payload else {}
+        return (current_payload or {}).get('checkpoint', {})
+    except Exception as e:
+        logger.warning(f"Failed to load checkpoint for task {task_id}: {e}")
+        return {}
+
+def save_task_checkpoint(task_id, stage, **outputs):
+    """
+    Record a completed pipeline stage (one of TASK_STAGES) and its outputs in the task's processing_queue payload.
+    """
+    try:
+        current_task = supabase.table('processing_queue').select('payload').eq('id', task_id).execute()
+        current_payload = current_task.data[0].get('payload', {}) if current_task.data else {}
+        if isinstance(current_payload, str):
+            current_payload = json.loads(current_payload) if current_payload else {}
+        current_payload = current_payload or {}
+        
+        checkpoint = current_payload.get('checkpoint', {})
+        completed_stages = checkpoint.get('completed_stages', [])
+        if stage not in completed_stages:
+            completed_stages.append(stage)
+        checkpoint['completed_stages'] = completed_stages
+        checkpoint.update(outputs)
+        current_payload['checkpoint'] = checkpoint
+        
+        supabase.table('processing_queue').update({
+            'payload': current_payload,
+            'updated_at': 'now()'
+        }).eq('id', task_id).execute()
+        logger.info(f"Checkpointed stage {stage} for task {task_id}")
+    except Exception as e:
+        logger.warning(f"Failed to checkpoint stage {stage} for task {task_id}: {e}")
+        # Don't raise - a missing checkpoint only costs repeated work on retry
+
+def classify_task(task_data):
+    """
+    Estimate a task's cost and pick its lane.
+    Orchestration tasks are always fast; AI tasks are slow if any estimate exceeds the fast-lane limits in task_lane_settings.
+    Returns (lane, priority, estimate).
+    """
+    application_id = task_data.get('application_id') or task_data.get('payload', {}).get('application_id')
+    estimate = {'documents': 0, 'bytes': 0, 'pages': 0}
+    
+    if task_data.get('task_type') != 'ai' or not application_id:
+        return 'fast', LANE_PRIORITIES['fast'], estimate
+    
+    try:
+        response = supabase.rpc('estimate_task_lane', {'p_application_id': application_id}).execute()
+        row = response.data[0] if response.data else None
+    except Exception as e:
+        logger.warning(f"Could not estimate task cost for application {application_id}, using fast lane: {e}")
+        return 'fast', LANE_PRIORITIES['fast'], estimate
+    
+    if not row:
+        return 'fast', LANE_PRIORITIES['fast'], estimate
+    
+    estimate = {'documents': row['documents'], 'bytes': row['bytes'], 'pages': row['pages']}
+    return row['lane'], row['priority'], estimate
+
+def forward_to_slow_lane(task_data):
+    """
+    Re-enqueue a task on the slow-lane queue.
+    Returns True if successful, False otherwise.
+    """
+    try:
+        response = sqs_client.send_message(
+            QueueUrl=SQS_SLOW_QUEUE_URL,
+            MessageBody=json.dumps(task_data)
+        )
+        logger.info(f"Routed {task_data.get('task_type')} task for application {task_data.get('application_id')} to slow lane. MessageId: {response.get('MessageId')}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to route task to slow lane, processing it here instead: {e}")
+        return False
+
+def record_lane_latency(lane, enqueued_at_ms):
+    """Record enqueue-to-completion latency for a lane. Returns the latency in ms."""
+    latency_ms = int(time.time() * 1000) - int(enqueued_at_ms)
+    lane_latencies[lane].append(latency_ms)
+    return latency_ms
+
+def lane_latency_percentiles():
+    """p50/p95/p99 enqueue-to-completion latency (ms) per lane over recent tasks in this process."""
+    report = {}
+    for lane, samples in lane_latencies.items():
+        if not samples:
+            continue
+        ordered = sorted(samples)
+        report[lane] = {'count': len(ordered)}
+        for p in (50, 95, 99):
+            # Nearest-rank percentile
+            report[lane][f'p{p}'] = ordered[max(0, -(-p * len(ordered) // 100) - 1)]
+    return report
+
+def acquire_task_lease(application_id, task_type, holder):
+    """
+    Take the single-flight lease for (application_id, task_type).
+    Returns True if holder owns the lease, False if another invocation has the task in flight.
+    """
+    try:
+        response = supabase.rpc('acquire_task_lease', {
+            'p_application_id': application_id,
+            'p_task_type': task_type,
+            'p_holder': holder,
+            'p_lease_seconds': TASK_LEASE_SECONDS
+        }).execute()
+        return bool(response.data)
+    except Exception as e:
+        # Fail open: if the lease table is unavailable (e.g. migration not applied), process anyway
+        logger.warning(f"Could not acquire lease for {task_type} task on application {application_id}, proceeding without it: {e}")
+        return True
+
+def release_task_lease(application_id, task_type, holder):
+    """
+    Release the single-flight lease if holder still owns it.
+    """
+    try:
+        supabase.rpc('release_task_lease', {
+            'p_application_id': application_id,
+            'p_task_type': task_type,
+            'p_holder': holder
+        }).execute()
+    except Exception as e:
+        logger.warning(f"Failed to release lease for {task_type} task on application {application_id}: {e}")
+        # Don't raise - the lease expires on its own
+
+def queue_url_from_arn(queue_arn):
+    """Build an SQS queue URL from an arn:aws:sqs:<region>:<account>:<name> ARN."""
+    parts = (queue_arn or '').split(':')
+    if len(parts) != 6:
+        return None
+    _, _, _, region, account, name = parts
+    return f"https://sqs.{region}.amazonaws.com/{account}/{name}"
+
+class TaskHeartbeat:
+    """
+    Keeps in-flight work visibly alive while it is processed.
+    A background thread periodically extends the visibility timeout of every SQS message in the
+    batch that has not finished yet (so records waiting behind a long task are not redelivered
+    either), and for the task being worked on refreshes processing_queue.locked_at and renews
+    the single-flight lease.
+    """
+
+    def __init__(self, records=None, task_id=None, lease=None):
+        self.records = {r.get('messageId'): r for r in records or [] if r.get('receiptHandle')}
+        self.task_id = task_id
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.visibility_error_logged = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="task-heartbeat", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join(timeout=5)
+
+    def track(self, task_id, lease=None):
+        """
+        Set the task whose locked_at and lease are renewed; track(None) stops renewing.
+        Waits for an in-progress beat, so a lease released afterwards is not renewed again.
+        """
+        with self.lock:
+            self.task_id = task_id
+            self.lease = lease
+
+    def finish(self, record):
+        """Stop extending the visibility of a processed message."""
+        with self.lock:
+            self.records.pop(record.get('messageId'), None)
+
+    def _run(self):
+        # Beat right away: the queue's visibility timeout may be shorter than the interval
+        if self.records:
+            self.beat()
+        while not self.stopped.wait(HEARTBEAT_INTERVAL_SECONDS):
+            self.beat()
+
+    def beat(self):
+        with self.lock:
+            if self.records:
+                self.extend_visibility()
+
+            if self.task_id:
+                try:
+                    supabase.table('processing_queue').update({
+                        'locked_at': 'now()',
+                        'updated_at': 'now()'
+                    }).eq('id', self.task_id).eq('status', 'processing').execute()
+                except Exception as e:
+                    logger.warning(f"Heartbeat failed to refresh locked_at for task {self.task_id}: {e}")
+
+            if self.lease and not acquire_task_lease(*self.lease):
+                logger.warning(f"Heartbeat could not renew lease for {self.lease[1]} task on application {self.lease[0]}: another invocation holds it")
+
+            logger.info(f"Heartbeat: {len(self.records)} message(s) in flight, task {self.task_id}")
+
+    def extend_visibility(self):
+        if not sqs_client:
+            return
+
+        by_queue = {}
+        for record in self.records.values():
+            queue_url = queue_url_from_arn(record.get('eventSourceARN'))
+            if queue_url:
+                by_queue.setdefault(queue_url, []).append(record)
+
+        for queue_url, records in by_queue.items():
+            # ChangeMessageVisibilityBatch takes at most 10 entries
+            for i in range(0, len(records), 10):
+                chunk = records[i:i + 10]
+                try:
+                    response = sqs_client.change_message_visibility_batch(
+                        QueueUrl=queue_url,
+                        Entries=[
+                            {
+                                'Id': str(n),
+                                'ReceiptHandle': record['receiptHandle'],
+                                'VisibilityTimeout': HEARTBEAT_VISIBILITY_TIMEOUT
+                            }
+                            for n, record in enumerate(chunk)
+                        ]
+                    )
+                    failed = response.get('Failed') or []
+                    if failed:
+                        details = "; ".join(f"{chunk[int(f['Id'])].get('messageId')}: {f.get('Message') or f.get('Code')}" for f in failed)
+                        self.visibility_failed(details)
+                except Exception as e:
+                    self.visibility_failed(str(e))
+
+    def visibility_failed(self, error):
+        # A persistent failure (e.g. missing sqs:ChangeMessageVisibility permission) means long tasks
+        # will be redelivered mid-flight, so surface the first one loudly
+        if not self.visibility_error_logged:
+            self.visibility_error_logged = True
+            logger.error(f"Heartbeat failed to extend message visibility; in-flight messages may be redelivered: {error}")
+        else:
+            logger.warning(f"Heartbeat failed to extend message visibility: {error}")
+
+def recover_stale_tasks():
+    """
+    Return tasks stuck in 'processing' with no heartbeat for STALE_LOCK_SECONDS to 'pending'.
+    Returns the number of recovered tasks.
+    """
+    try:
+        response = supabase.rpc('recover_stale_tasks', {'p_stale_seconds': STALE_LOCK_SECONDS}).execute()
+        recovered = response.data or 0
+        if recovered:
+            logger.warning(f"Recovered {recovered} stale task(s) with no heartbeat for {STALE_LOCK_SECONDS}s")
+        return recovered
+    except Exception as e:
+        logger.warning(f"Failed to recover stale tasks: {e}")
+        return 0
+
+def process_sqs_message(record, heartbeat=None):
     """
     Process a single SQS message record.
+    heartbeat is the batch's TaskHeartbeat; the task and lease are attached to it while they are live.
     Returns (success: bool, message_id: str, error: str or None)
     """
     message_id = record.get('messageId')
     body = record.get('body', '{}')
+    lease = None
     
     try:
         # Parse message body
         task_data = json.loads(body)
         logger.info(f"Processing SQS message {message_id}: {task_data}")
         
+        # Scheduling: classify once; tasks routed to a lane keep it on later deliveries
+        if 'enqueued_at' not in task_data:
+            task_data['enqueued_at'] = int(record.get('attributes', {}).get('SentTimestamp') or time.time() * 1000)
+        if 'lane' not in task_data:
+            lane, priority, estimate = classify_task(task_data)
+            task_data['lane'] = lane
+            task_data.setdefault('payload', {})['priority'] = priority
+            logger.info(f"Classified {task_data.get('task_type')} task as {lane} lane (priority {priority}): {estimate}")
+            if lane == 'slow' and sqs_client and SQS_SLOW_QUEUE_URL and forward_to_slow_lane(task_data):
+                return (True, message_id, None)
+        
+        # Single-flight: only one invocation may work on (application_id, task_type) at a time.
+        # Redeliveries reuse the messageId, so the holder is unique per invocation.
+        lease_application_id = task_data.get('application_id') or task_data.get('payload', {}).get('application_id')
+        lease_task_type = task_data.get('task_type')
+        if lease_application_id and lease_task_type:
+            holder = f"{message_id}:{uuid.uuid4()}"
+            if not acquire_task_lease(lease_application_id, lease_task_type, holder):
+                # Don't ack: if the holder dies, this message is the only copy left. Returning it as a
+                # failure lets SQS redeliver it after the visibility timeout, by which time the holder
+                # has either finished (and the redelivery is acknowledged below) or its lease has lapsed
+                # (and the redelivery resumes the holder's task from its checkpoints).
+                error_msg = f"{lease_task_type} task for application {lease_application_id} is already in flight"
+                logger.info(f"{error_msg}. Returning message {message_id} for redelivery")
+                return (False, message_id, error_msg)
+            lease = (lease_application_id, lease_task_type, holder)
+            if heartbeat:
+                heartbeat.track(None, lease)
+            
+            # A duplicate returned while another invocation held the lease comes back after that
+            # invocation finished; the work it carries was completed after it was sent
+            completed_task_id = find_completed_task(lease_application_id, lease_task_type, task_data['enqueued_at'])
+            if completed_task_id:
+                logger.info(f"{lease_task_type} task for application {lease_application_id} was already completed by task {completed_task_id} after message {message_id} was sent. Acknowledging duplicate")
+                return (True, message_id, None)
+        
         # Find or create task record in processing_queue
         task_id = find_or_create_task_record(task_data)
         if not task_id:
             raise Exception("Could not find or create task record")
         
-        # Update status to processing
+        # Update status to processing (the row's priority column was set on insert)
+        priority = task_data.get('payload', {}).get('priority', 0)
         update_task_status(task_id, 'processing')
         
-        # Process the task
-        result = process_task(task_data, task_id)
+        # Keep the task record live while we work
+        if heartbeat:
+            heartbeat.track(task_id, lease)
         
-        # Update status to completed
-        update_task_status(task_id, 'completed', result=result)
+        # Process the task
+        result = run_task(task_data, task_id)
         
         # If AI task completed successfully, send orchestration task to SQS
         if task_data.get('task_type') == 'ai' and result.get('result') == 'success':
             application_id = task_data.get('application_id') or task_data.get('payload', {}).get('application_id')
-            if application_id:
+            completed_stages = load_task_checkpoint(task_id).get('completed_stages', []) if application_id else []
+            if 'orchestration_enqueued' in completed_stages:
+                logger.info(f"Resuming task {task_id} from checkpoint: orchestration task already enqueued")
+            elif application_id:
                 logger.info(f"AI task completed successfully, sending orchestration task to SQS for application {application_id}")
-                # Also create record in processing_queue for orchestration task
-                try:
-                    supabase.table('processing_queue').insert({
-                        'application_id': application_id,
-                        'task_type': 'orchestration',
-                        'payload': {'application_id': application_id},
-                        'status': 'pending'
-                    }).execute()
-                except Exception as e:
-                    logger.warning(f"Failed to create orchestration task record in DB: {e}")
+                # Also create record in processing_queue for orchestration task (always fast lane),
+                # once: a retry after a failed send must not add a second record
+                if 'orchestration_recorded' not in completed_stages:
+                    try:
+                        supabase.table('processing_queue').insert({
+                            'application_id': application_id,
+                            'task_type': 'orchestration',
+                            'payload': {'application_id': application_id, 'priority': priority},
+                            'priority': LANE_PRIORITIES['fast'],
+                            'status': 'pending'
+                        }).execute()
+                        save_task_checkpoint(task_id, 'orchestration_recorded')
+                    except Exception as e:
+                        logger.warning(f"Failed to create orchestration task record in DB: {e}")
                 
-                # Send to SQS
-                send_orchestration_task_to_sqs(application_id)
+                # Send to SQS; on failure the message is retried and resumes here from the checkpoints
+                if not send_orchestration_task_to_sqs(application_id, priority):
+                    raise Exception(f"Failed to enqueue orchestration task for application {application_id}")
+                save_task_checkpoint(task_id, 'orchestration_enqueued')
+        
+        # Update status to completed
+        if isinstance(result, dict):
+            result['lane'] = task_data['lane']
+            result['latency_ms'] = record_lane_latency(task_data['lane'], task_data['enqueued_at'])
+        update_task_status(task_id, 'completed', result=result)
         
         return (True, message_id, None)
         
@@ -751,6 +1927,12 @@ def process_sqs_message(record):
             pass  # Ignore errors in error handling
         
         return (False, message_id, error_msg)
+    finally:
+        if heartbeat:
+            # Stop renewing before releasing, or a late beat would take the lease again
+            heartbeat.track(None)
+        if lease:
+            release_task_lease(*lease)
 
 def lambda_handler(event, context):
     """
@@ -763,19 +1945,27 @@ def lambda_handler(event, context):
     Returns:
         Response with batchItemFailures for partial batch failure handling
     """
-    logger.info(f"Lambda invoked with {len(event.get('Records', []))} SQS message(s)")
+    records = event.get('Records', [])
+    logger.info(f"Lambda invoked with {len(records)} SQS message(s)")
     
     batch_item_failures = []
     
-    for record in event.get('Records', []):
-        message_id = record.get('messageId')
-        success, msg_id, error = process_sqs_message(record)
-        
-        if not success:
-            logger.error(f"Failed to process message {msg_id}: {error}")
-            batch_item_failures.append({
-                "itemIdentifier": message_id
-            })
+    # Records are processed one at a time, but all of them are in flight from delivery:
+    # keep every unfinished message invisible until its turn comes and it is done
+    heartbeat = TaskHeartbeat(records).start()
+    try:
+        for record in records:
+            message_id = record.get('messageId')
+            success, msg_id, error = process_sqs_message(record, heartbeat)
+            heartbeat.finish(record)
+            
+            if not success:
+                logger.error(f"Failed to process message {msg_id}: {error}")
+                batch_item_failures.append({
+                    "itemIdentifier": message_id
+                })
+    finally:
+        heartbeat.stop()
     
     # Return response for partial batch failure handling
     response = {}
@@ -785,6 +1975,10 @@ def lambda_handler(event, context):
     else:
         logger.info("All messages processed successfully")
     
+    percentiles = lane_latency_percentiles()
+    if percentiles:
+        logger.info(f"Lane latency percentiles (ms): {percentiles}")
+    
     return response
 
 def worker_loop():
@@ -794,6 +1988,7 @@ def worker_loop():
     """
     logger.warning("Using legacy worker_loop(). This should only be used for local testing.")
     logger.info("Worker started. Waiting for tasks...")
+    last_recovery = 0
     
     while True:
         try:
@@ -804,16 +1999,26 @@ def worker_loop():
             tasks = response.data
             
             if not tasks:
+                # Put back tasks whose worker stopped sending heartbeats
+                if time.time() - last_recovery > HEARTBEAT_INTERVAL_SECONDS:
+                    recover_stale_tasks()
+                    last_recovery = time.time()
                 # No tasks, sleep and retry
                 time.sleep(5) # Poll interval
                 continue
             
             task = tasks[0]
             task_id = task['id']
+            task['payload'] = task['payload'] or {}
+            
+            # Carry the task's scheduling priority through to assign_reviewer
+            if task['task_type'] == 'ai' and 'priority' not in task['payload']:
+                _, task['payload']['priority'], _ = classify_task(task)
             
             # 2. Process the task
+            heartbeat = TaskHeartbeat(task_id=task_id).start()
             try:
-                result = process_task(task, task_id)
+                result = run_task(task, task_id)
                 
                 # 3. Mark as completed
                 # Note: We merge the result into the existing payload
@@ -835,7 +2040,8 @@ def worker_loop():
                             supabase.table('processing_queue').insert({
                                 'application_id': application_id,
                                 'task_type': 'orchestration',
-                                'payload': {'application_id': application_id},
+                                'payload': {'application_id': application_id, 'priority': task['payload'].get('priority', 0)},
+                                'priority': LANE_PRIORITIES['fast'],
                                 'status': 'pending'
                             }).execute()
                             logger.info(f"Orchestration task created for application {application_id}")
@@ -851,6 +2057,8 @@ def worker_loop():
                     'last_error': str(e),
                     'updated_at': 'now()'
                 }).eq('id', task_id).execute()
+            finally:
+                heartbeat.stop()
                     
         except Exception as e:
             logger.error(f"Unexpected error in worker loop: {e}")
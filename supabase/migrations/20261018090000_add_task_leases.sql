@@ -0,0 +1,71 @@
+-- Migration: add_task_leases
+-- Single-flight leases for AI worker tasks, keyed by (application_id, task_type).
+-- SQS delivers at least once, so the worker takes a lease before processing and hands
+-- duplicate deliveries back to SQS for redelivery while another invocation holds it.
+-- Leases are short and renewed by the worker's heartbeat.
+
+CREATE TABLE IF NOT EXISTS task_leases (
+  application_id UUID NOT NULL REFERENCES applications(id) ON DELETE CASCADE,
+  task_type TEXT NOT NULL,
+  holder TEXT NOT NULL,
+  acquired_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+  PRIMARY KEY (application_id, task_type)
+);
+
+ALTER TABLE task_leases ENABLE ROW LEVEL SECURITY;
+
+-- Create index on expires_at for stale lease cleanup
+CREATE INDEX IF NOT EXISTS idx_task_leases_expires_at ON task_leases(expires_at);
+
+-- Take (or renew) the lease. Returns TRUE when p_holder owns it afterwards.
+-- An existing lease is only taken over once it has expired.
+CREATE OR REPLACE FUNCTION public.acquire_task_lease(p_application_id uuid, p_task_type text, p_holder text, p_lease_seconds integer DEFAULT 180)
+ RETURNS boolean
+ LANGUAGE plpgsql
+ SECURITY DEFINER
+AS $function$
+DECLARE
+  v_holder text;
+BEGIN
+  INSERT INTO task_leases (
+    application_id,
+    task_type,
+    holder,
+    acquired_at,
+    expires_at
+  ) VALUES (
+    p_application_id,
+    p_task_type,
+    p_holder,
+    NOW(),
+    NOW() + make_interval(secs => p_lease_seconds)
+  )
+  ON CONFLICT (application_id, task_type)
+  DO UPDATE SET
+    holder = EXCLUDED.holder,
+    acquired_at = CASE WHEN task_leases.holder = EXCLUDED.holder THEN task_leases.acquired_at ELSE EXCLUDED.acquired_at END,
+    expires_at = EXCLUDED.expires_at
+  WHERE task_leases.holder = EXCLUDED.holder
+     OR task_leases.expires_at < NOW()
+  RETURNING holder INTO v_holder;
+
+  RETURN v_holder IS NOT NULL;
+END;
+$function$;
+
+-- Release the lease, but only if p_holder still owns it.
+CREATE OR REPLACE FUNCTION public.release_task_lease(p_application_id uuid, p_task_type text, p_holder text)
+ RETURNS boolean
+ LANGUAGE plpgsql
+ SECURITY DEFINER
+AS $function$
+BEGIN
+  DELETE FROM task_leases
+  WHERE application_id = p_application_id
+    AND task_type = p_task_type
+    AND holder = p_holder;
+
+  RETURN FOUND;
+END;
+$function$;
@@ -0,0 +1,43 @@
+-- Migration: add_processing_queue_priority
+-- Priority lanes for AI worker tasks, by estimated cost
+-- (documents, bytes, pages); higher priority is fetched first.
+
+ALTER TABLE processing_queue ADD COLUMN IF NOT EXISTS priority INTEGER DEFAULT 0;
+
+-- Create index for priority-ordered polling of pending tasks
+CREATE INDEX IF NOT EXISTS idx_processing_queue_pending_priority
+ON processing_queue(priority DESC, created_at ASC)
+WHERE status = 'pending';
+
+-- Fetch the highest-priority pending task first, oldest first within a priority
+CREATE OR REPLACE FUNCTION public.fetch_next_task()
+ RETURNS TABLE(id uuid, task_type text, payload jsonb)
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+    selected_task_id UUID;
+BEGIN
+    -- Find and lock the next pending task
+    SELECT pq.id INTO selected_task_id
+    FROM processing_queue pq
+    WHERE pq.status = 'pending'
+    ORDER BY pq.priority DESC, pq.created_at ASC
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED;
+
+    -- If a task was found, update it to 'processing' and return it
+    IF selected_task_id IS NOT NULL THEN
+        UPDATE processing_queue
+        SET status = 'processing',
+            locked_at = NOW(),
+            updated_at = NOW(),
+            attempts = attempts + 1
+        WHERE processing_queue.id = selected_task_id;
+
+        RETURN QUERY
+        SELECT pq.id, pq.task_type, pq.payload
+        FROM processing_queue pq
+        WHERE pq.id = selected_task_id;
+    END IF;
+END;
+$function$;
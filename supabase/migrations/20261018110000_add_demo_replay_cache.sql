@@ -0,0 +1,23 @@
+-- Migration: add_demo_replay_cache
+-- Recorded AI results for demo submissions of the sample application.
+-- Keyed by a hash of the document contents and application data; version_hash covers
+-- the prompts, schemas and model, so a change re-records on the next demo.
+
+CREATE TABLE IF NOT EXISTS demo_replay_cache (
+  document_set_hash TEXT PRIMARY KEY,
+  version_hash TEXT NOT NULL,
+  recorded_application_id UUID,
+  recorded_submission_date TEXT,
+  extractor_output JSONB,
+  reasoning_output JSONB NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE demo_replay_cache ENABLE ROW LEVEL SECURITY;
+
+-- Add updated_at trigger
+CREATE TRIGGER update_demo_replay_cache_updated_at
+  BEFORE UPDATE ON demo_replay_cache
+  FOR EACH ROW
+  EXECUTE FUNCTION update_updated_at_column();
@@ -0,0 +1,29 @@
+-- Migration: add_stale_task_recovery
+-- The AI worker refreshes processing_queue.locked_at on a heartbeat while a task runs.
+-- A 'processing' task whose locked_at is older than the stale threshold has lost its worker
+-- and is returned to 'pending' so it can be picked up again.
+
+-- Create index for finding stale processing tasks
+CREATE INDEX IF NOT EXISTS idx_processing_queue_processing_locked_at
+ON processing_queue(locked_at)
+WHERE status = 'processing';
+
+CREATE OR REPLACE FUNCTION public.recover_stale_tasks(p_stale_seconds integer DEFAULT 600)
+ RETURNS integer
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+    recovered_count INTEGER;
+BEGIN
+    UPDATE processing_queue
+    SET status = 'pending',
+        last_error = 'Recovered stale lock: no heartbeat since ' || locked_at::text,
+        locked_at = NULL,
+        updated_at = NOW()
+    WHERE status = 'processing'
+      AND locked_at < NOW() - make_interval(secs => p_stale_seconds);
+
+    GET DIAGNOSTICS recovered_count = ROW_COUNT;
+    RETURN recovered_count;
+END;
+$function$;
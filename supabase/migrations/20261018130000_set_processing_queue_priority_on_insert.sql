@@ -0,0 +1,64 @@
+-- Migration: set_processing_queue_priority_on_insert
+-- Set processing_queue.priority when a task is inserted, so fetch_next_task() can order
+-- pending tasks by it. AI tasks are classified by estimated cost from the application's
+-- uploaded files; orchestration tasks are always fast.
+-- Thresholds are moved to the task_lane_settings table by 20261018140000_add_task_lane_settings.
+
+CREATE OR REPLACE FUNCTION public.set_processing_queue_priority()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+  v_documents integer;
+  v_bytes bigint;
+  v_pages bigint;
+BEGIN
+  IF NEW.task_type = 'orchestration' THEN
+    NEW.priority := 10;
+  ELSIF NEW.task_type = 'ai' THEN
+    -- Same estimate as the worker: about 100 KiB per page, at least one page per file
+    SELECT
+      COUNT(*),
+      COALESCE(SUM(COALESCE(af.file_size, 0)), 0),
+      COALESCE(SUM(GREATEST(1, COALESCE(af.file_size, 0) / 102400)), 0)
+    INTO v_documents, v_bytes, v_pages
+    FROM application_files af
+    WHERE af.application_id = NEW.application_id;
+
+    IF v_documents > 3 OR v_bytes > 5242880 OR v_pages > 30 THEN
+      NEW.priority := 0;   -- slow lane
+    ELSE
+      NEW.priority := 10;  -- fast lane
+    END IF;
+  END IF;
+
+  RETURN NEW;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS set_processing_queue_priority ON processing_queue;
+CREATE TRIGGER set_processing_queue_priority
+  BEFORE INSERT ON processing_queue
+  FOR EACH ROW
+  EXECUTE FUNCTION public.set_processing_queue_priority();
+
+-- Classify tasks that were queued before this migration
+UPDATE processing_queue pq
+SET priority = CASE
+  WHEN pq.task_type = 'orchestration' THEN 10
+  WHEN files.documents > 3 OR files.bytes > 5242880 OR files.pages > 30 THEN 0
+  ELSE 10
+END
+FROM (
+  SELECT
+    q.id,
+    COUNT(af.id) AS documents,
+    COALESCE(SUM(COALESCE(af.file_size, 0)), 0) AS bytes,
+    COALESCE(SUM(GREATEST(1, COALESCE(af.file_size, 0) / 102400)) FILTER (WHERE af.id IS NOT NULL), 0) AS pages
+  FROM processing_queue q
+  LEFT JOIN application_files af ON af.application_id = q.application_id
+  WHERE q.status = 'pending'
+  GROUP BY q.id
+) files
+WHERE pq.id = files.id
+  AND pq.task_type IN ('ai', 'orchestration');
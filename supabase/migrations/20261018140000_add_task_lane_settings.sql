@@ -0,0 +1,76 @@
+-- Migration: add_task_lane_settings
+-- Single source of truth for the fast/slow lane thresholds. estimate_task_lane() is used both by
+-- the processing_queue insert trigger (priority) and by the AI worker (SQS lane routing), so
+-- tuning a threshold here changes both together.
+
+CREATE TABLE IF NOT EXISTS task_lane_settings (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  fast_lane_max_documents INTEGER NOT NULL DEFAULT 3,
+  fast_lane_max_bytes BIGINT NOT NULL DEFAULT 5242880,
+  fast_lane_max_pages INTEGER NOT NULL DEFAULT 30,
+  -- Pages are unknown before download, so they are estimated from file sizes
+  estimated_bytes_per_page INTEGER NOT NULL DEFAULT 102400,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE task_lane_settings ENABLE ROW LEVEL SECURITY;
+
+INSERT INTO task_lane_settings (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+CREATE TRIGGER update_task_lane_settings_updated_at
+  BEFORE UPDATE ON task_lane_settings
+  FOR EACH ROW
+  EXECUTE FUNCTION update_updated_at_column();
+
+-- Estimate an AI task's cost from the application's files and pick its lane.
+-- A task is slow if any estimate exceeds its fast-lane limit.
+CREATE OR REPLACE FUNCTION public.estimate_task_lane(p_application_id uuid)
+ RETURNS TABLE(documents integer, bytes bigint, pages bigint, lane text, priority integer)
+ LANGUAGE plpgsql
+ STABLE
+ SECURITY DEFINER
+AS $function$
+DECLARE
+  v_settings task_lane_settings%ROWTYPE;
+BEGIN
+  SELECT * INTO v_settings FROM task_lane_settings LIMIT 1;
+
+  SELECT
+    COUNT(*)::integer,
+    COALESCE(SUM(COALESCE(af.file_size, 0)), 0)::bigint,
+    COALESCE(SUM(GREATEST(1, COALESCE(af.file_size, 0) / v_settings.estimated_bytes_per_page)), 0)::bigint
+  INTO documents, bytes, pages
+  FROM application_files af
+  WHERE af.application_id = p_application_id;
+
+  IF documents > v_settings.fast_lane_max_documents
+     OR bytes > v_settings.fast_lane_max_bytes
+     OR pages > v_settings.fast_lane_max_pages THEN
+    lane := 'slow';
+    priority := 0;
+  ELSE
+    lane := 'fast';
+    priority := 10;
+  END IF;
+
+  RETURN NEXT;
+END;
+$function$;
+
+-- The insert trigger now takes its thresholds from task_lane_settings
+CREATE OR REPLACE FUNCTION public.set_processing_queue_priority()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+  IF NEW.task_type = 'orchestration' THEN
+    NEW.priority := 10;
+  ELSIF NEW.task_type = 'ai' THEN
+    SELECT estimate.priority INTO NEW.priority
+    FROM estimate_task_lane(NEW.application_id) AS estimate;
+  END IF;
+
+  RETURN NEW;
+END;
+$function$;